@@ -187,4 +187,6 @@ plt.show()
 # To go further, try:
 # - Integrating rainfall separately for NMDB and SMDB
 # - Comparing trends or seasonal cycles between them
-# - Exporting the rainfall time series to CSV for reporting
\ No newline at end of file
+# - Exporting the rainfall time series to CSV for reporting
+# - Loading `rain_day` in compact form with `watercourse.rainfall.load_rain_day("rain_day_2025.nc", mode="float32")`,
+#   which stores float32 values with NaN instead of a float64 masked array
\ No newline at end of file
@@ -0,0 +1,8 @@
+"""Helper routines used alongside the water-course tutorials.
+
+The tutorials themselves (``basics_00.py``, ``basics_01.py``, ``basics_02.py``
+and ``Ex1_Precipitation.py``) keep the simple, step-by-step code that is taught
+in class.  The modules in this package hold the faster or more scalable
+versions of the same steps, for when the tutorial workflow is run on larger
+datasets.
+"""
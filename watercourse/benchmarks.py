@@ -0,0 +1,307 @@
+"""Benchmarks of the tutorial processing steps on synthetic data.
+
+Each suite times the step as written in the tutorials (the *reference*) and
+its counterpart in this package (the *candidate*) over inputs of increasing
+size, checks that both give the same answer, and reports:
+
+- run time (best of ``--repeat``) and throughput in work items per second,
+- peak memory allocated during the call (``tracemalloc``, separate run),
+- the largest absolute difference between reference and candidate, and
+- the scaling exponent of each implementation (slope of log time against log
+  work items).
+
+Suites:
+
+``interpolation``
+  ``IDW()`` looped over the grid (``Ex1_Precipitation.py``) against
+  :func:`watercourse.interpolate.idw_grid`; gauges x grid cells.
+``masking``
+  the ``Point.within`` double loop (``basics_01.py``) against
+  :func:`watercourse.rainfall.basin_mask`; grid cells and polygon vertices.
+``aggregation``
+  the ``MDB_total_rain`` loop over a masked array (``basics_01.py``) against
+  :func:`watercourse.rainfall.basin_mean` on float32; lat x lon x time.
+``areas``
+  the ``areas`` expression of ``basics_02.py`` against
+  :func:`watercourse.regrid.cell_areas`; lat x lon.
+``extremes``
+  per-cell ``np.percentile`` and annual maxima of a daily cube held in
+  memory against :func:`watercourse.extremes.rainfall_extremes` (percentiles
+  within its 1 % error bound); lat x lon x time.
+
+The reference loops are slow, so they are only run up to a size cap; larger
+sizes time the candidate alone.
+
+Usage::
+
+    python -m watercourse.benchmarks [--suite NAME ...] [--scale small|medium|large]
+                                     [--repeat N] [--json FILE]
+"""
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+
+# Reference implementations, as written in the tutorials
+
+def reference_idw(x, y, stnX, stnY, stnP, b=-2):
+    distX = x - stnX
+    distY = y - stnY
+    dist = np.sqrt(distX**2 + distY**2)
+    idw = dist**b
+    p = np.sum(idw / np.sum(idw) * stnP)
+    return round(p, 1)
+
+
+def reference_idw_grid(X, Y, stnX, stnY, stnP, b=-2):
+    pcp = np.zeros((len(Y), len(X)))
+    for i, y in enumerate(Y[::-1]):
+        for j, x in enumerate(X):
+            pcp[i, j] = reference_idw(x, y, stnX, stnY, stnP, b=b)
+    return pcp
+
+
+def reference_mask(polygon, lats, lons):
+    from shapely.geometry import Point
+
+    mask = np.zeros((len(lats), len(lons)))
+    for ilat in range(len(lats)):
+        for ilon in range(len(lons)):
+            if Point([lons[ilon], lats[ilat]]).within(polygon):
+                mask[ilat, ilon] = True
+    return mask
+
+
+def reference_basin_total(rain_day, MDB_mask):
+    MDB_total_rain = np.zeros(len(rain_day))
+    for i in range(len(rain_day)):
+        MDB_total_rain[i] = np.sum(MDB_mask * rain_day[i]) / np.sum(MDB_mask)
+    return MDB_total_rain
+
+
+def reference_areas(lats, lons, spacing):
+    lons_x, lats_x = np.meshgrid(lons, lats)
+    Rearth = 6370e3
+    return Rearth ** 2 * abs(np.sin(np.radians(lats_x[1:, :])) - np.sin(np.radians(lats_x[:-1, :]))) * np.radians(spacing)
+
+
+# Synthetic inputs
+
+def _gauges(rng, n, extent=(382200, 390200, 4771400, 4779400)):
+    x0, x1, y0, y1 = extent
+    return rng.uniform(x0, x1, n), rng.uniform(y0, y1, n), rng.gamma(4, 3, n)
+
+
+def _polygon(nvertices, centre=(146.0, -30.0), radius=5.0):
+    from shapely.geometry import Polygon
+
+    angle = np.linspace(0, 2 * np.pi, nvertices, endpoint=False)
+    r = radius * (1 + 0.2 * np.sin(7 * angle))
+    return Polygon(np.column_stack([centre[0] + r * np.cos(angle), centre[1] + r * np.sin(angle)]))
+
+
+def _grid(n, extent=(138.0, 154.0, -38.0, -22.0)):
+    lon0, lon1, lat0, lat1 = extent
+    return np.linspace(lat1, lat0, n), np.linspace(lon0, lon1, n)
+
+
+# Suites: each yields cases of (parameters, work items, reference or None,
+# candidate, np.allclose tolerances)
+
+SCALES = {"small": 0, "medium": 1, "large": 2}
+
+
+def suite_interpolation(rng, scale):
+    from .interpolate import idw_grid
+
+    for ngauges in [10, 100, 1000][:scale + 2]:
+        for side in [20, 40, 80, 160, 320, 640][:scale + 4]:
+            X = np.linspace(382200, 390200, side, endpoint=False)
+            Y = np.linspace(4771400, 4779400, side, endpoint=False)
+            sx, sy, sp = _gauges(rng, ngauges)
+            reference = None
+            if side <= 80:
+                reference = lambda: reference_idw_grid(X, Y, sx, sy, sp)  # noqa: E731
+            # the reference rounds to 0.1 mm
+            yield ({"gauges": ngauges, "cells": side * side}, ngauges * side * side,
+                   reference, lambda: idw_grid(X, Y, sx, sy, sp), {"atol": 0.05 + 1e-9, "rtol": 0})
+
+
+def suite_masking(rng, scale):
+    from .rainfall import basin_mask
+
+    for nvertices in [100, 1000, 10000][:scale + 2]:
+        polygon = _polygon(nvertices)
+        for side in [25, 50, 100, 200, 400, 800][:scale + 4]:
+            lats, lons = _grid(side)
+            reference = None
+            if side <= 100:
+                reference = lambda: reference_mask(polygon, lats, lons)  # noqa: E731
+            yield ({"vertices": nvertices, "cells": side * side}, side * side,
+                   reference, lambda: basin_mask(polygon, lats, lons), {"atol": 0, "rtol": 0})
+
+
+def suite_aggregation(rng, scale):
+    from .rainfall import basin_mask, basin_mean
+
+    polygon = _polygon(1000)
+    for side in [50, 100, 200][:scale + 2]:
+        lats, lons = _grid(side)
+        mask = basin_mask(polygon, lats, lons)
+        for ntime in [100, 1000, 10000][:scale + 2]:
+            compact = rng.gamma(0.5, 4, (ntime, side, side)).astype(np.float32)
+            compact[rng.random(compact.shape) < 0.01] = np.nan
+            reference = None
+            if ntime * side * side <= 4e7:
+                masked = np.ma.masked_invalid(compact.astype(np.float64))
+                reference = lambda: reference_basin_total(masked, mask.astype(float))  # noqa: E731
+            yield ({"lat": side, "lon": side, "time": ntime}, ntime * side * side,
+                   reference, lambda: basin_mean(compact, mask), {"atol": 1e-4, "rtol": 0})
+
+
+def suite_areas(rng, scale):
+    from .regrid import cell_areas, cell_edges
+
+    for side in [100, 400, 1600, 3200][:scale + 2]:
+        spacing = 160.0 / side
+        lats = np.arange(-80 + spacing / 2, 80, spacing)
+        lons = np.arange(spacing / 2, 360, spacing)
+        # the reference gives areas between consecutive latitudes, so it is
+        # evaluated on the cell edges to get the areas of the cells
+        edges = cell_edges(lats)
+        yield ({"lat": len(lats), "lon": len(lons)}, len(lats) * len(lons),
+               lambda: reference_areas(edges, lons, spacing), lambda: cell_areas(lats, lons), {"atol": 0, "rtol": 1e-9})
+
+
+def reference_extremes(cube, starts, quantiles):
+    percentiles = np.percentile(cube, np.multiply(quantiles, 100), axis=0, method="lower")
+    return np.concatenate([percentiles, np.fmax.reduceat(cube, starts, axis=0)])
+
+
+def suite_extremes(rng, scale):
+    from .extremes import rainfall_extremes
+    from .resample import group_starts
+
+    quantiles = (0.95, 0.99)
+    for side in [50, 100, 200][:scale + 2]:
+        for ntime in [365, 3650, 10950][:scale + 2]:
+            cube = rng.gamma(0.4, 8, (ntime, side, side)).astype(np.float32)
+            cube[rng.random(cube.shape) < 0.6] = 0
+            dates = np.datetime64("1990-01-01") + np.arange(ntime)
+            starts, _ = group_starts(dates, "year")
+
+            def candidate(cube=cube, dates=dates):
+                result = rainfall_extremes(cube, dates, quantiles)
+                return np.concatenate([result.percentiles, result.annual_max])
+
+            # percentiles are within 1 %, or 0 below the sketch's 0.1 mm floor
+            yield ({"lat": side, "lon": side, "time": ntime}, ntime * side * side,
+                   lambda: reference_extremes(cube, starts, quantiles), candidate, {"atol": 0.1, "rtol": 0.01})
+
+
+SUITES = {
+    "interpolation": suite_interpolation,
+    "masking": suite_masking,
+    "aggregation": suite_aggregation,
+    "areas": suite_areas,
+    "extremes": suite_extremes,
+}
+
+
+def _time(function, repeat):
+    best, result = np.inf, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def _peak_memory(function):
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _scaling(rows, key):
+    points = [(row["items"], row[key]) for row in rows if row.get(key)]
+    if len(points) < 2 or len({p[0] for p in points}) < 2:
+        return None
+    items, seconds = np.log(np.array(points)).T
+    return float(np.polyfit(items, seconds, 1)[0])
+
+
+def run_suite(name, scale="small", repeat=3, seed=0, log=print):
+    """Run one suite; returns its list of result rows."""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for params, items, reference, candidate, tolerance in SUITES[name](rng, SCALES[scale]):
+        row = dict(params, items=items)
+        row["candidate_s"], result = _time(candidate, repeat)
+        row["candidate_peak_bytes"] = _peak_memory(candidate)
+        row["candidate_items_per_s"] = items / row["candidate_s"]
+        if reference is not None:
+            row["reference_s"], expected = _time(reference, 1 if items > 1e5 else repeat)
+            row["reference_peak_bytes"] = _peak_memory(reference)
+            row["reference_items_per_s"] = items / row["reference_s"]
+            row["speedup"] = row["reference_s"] / row["candidate_s"]
+            row["max_abs_diff"] = float(np.nanmax(np.abs(np.asarray(expected, dtype=float) - result)))
+            row["correct"] = bool(np.allclose(result, expected, equal_nan=True, **tolerance))
+        rows.append(row)
+        log(_format_row(name, row))
+    return rows
+
+
+def _format_row(name, row):
+    params = " ".join(f"{k}={row[k]}" for k in row if k not in _RESULT_KEYS)
+    text = (f"{name:<13} {params:<32} cand {row['candidate_s'] * 1e3:9.2f} ms "
+            f"{row['candidate_items_per_s']:10.3g}/s {row['candidate_peak_bytes'] / 2**20:8.1f} MiB")
+    if "reference_s" in row:
+        text += (f" | ref {row['reference_s'] * 1e3:9.2f} ms {row['reference_peak_bytes'] / 2**20:8.1f} MiB"
+                 f" | x{row['speedup']:8.1f} diff {row['max_abs_diff']:.2g}"
+                 f" {'ok' if row['correct'] else 'MISMATCH'}")
+    return text
+
+
+_RESULT_KEYS = {
+    "items", "candidate_s", "candidate_peak_bytes", "candidate_items_per_s", "reference_s",
+    "reference_peak_bytes", "reference_items_per_s", "speedup", "max_abs_diff", "correct",
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--suite", nargs="+", choices=sorted(SUITES), default=list(SUITES))
+    parser.add_argument("--scale", choices=list(SCALES), default="small")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    report = {}
+    for name in args.suite:
+        rows = run_suite(name, args.scale, args.repeat, args.seed)
+        report[name] = {
+            "cases": rows,
+            "scaling": {"candidate": _scaling(rows, "candidate_s"), "reference": _scaling(rows, "reference_s")},
+        }
+        scaling = report[name]["scaling"]
+        print(f"{name:<13} scaling exponent: candidate {scaling['candidate'] or float('nan'):.2f}, "
+              f"reference {scaling['reference'] or float('nan'):.2f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=1)
+    mismatches = [row for suite in report.values() for row in suite["cases"] if row.get("correct") is False]
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
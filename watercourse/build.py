@@ -0,0 +1,131 @@
+"""Parallel, cached build of the exercise and solution notebooks.
+
+Runs the same jupytext / nbconvert steps as the ``exercise-%`` and
+``solution-%`` Makefile rules, but
+
+- all conversions run in parallel (``--jobs``), and
+- every converted notebook is cached under a key made of the tutorial source,
+  the input data it reads, and the conversion settings. A tutorial whose
+  source and data are unchanged is copied from the cache instead of being
+  converted (and, for solutions, executed) again.
+
+Usage::
+
+    python -m watercourse.build [--jobs N] [--cache-dir DIR] [SOURCE ...]
+"""
+
+import argparse
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .cache import DataHashes, atomic_write, cache_dir, file_hash
+
+SOURCE_FILES = ["basics_00.py", "basics_01.py", "basics_02.py", "Ex1_Precipitation.py"]
+
+# Input data read by each tutorial when its solution notebook is executed
+DATA_FILES = {
+    "basics_01.py": ["MDB_boundaries.zip", "rain_day_2025.nc"],
+    "basics_02.py": ["CSR_GRACE_GRACE-FO_RL0603_Mascons_all-corrections.nc"],
+    "Ex1_Precipitation.py": ["RainfallData_Exercise_001.csv"],
+}
+
+# kind: (tag removed from the notebook, output suffix, execute)
+KINDS = {
+    "exercise": ("solution", "", False),
+    "solution": ("empty-cell", "_solution", True),
+}
+
+
+def build_key(source, kind, data_hashes):
+    """Cache key of one converted notebook."""
+    digest = hashlib.sha256(f"notebook-v1 {kind} {KINDS[kind]}".encode())
+    digest.update(file_hash(source).encode())
+    if KINDS[kind][2]:
+        for filename in DATA_FILES.get(Path(source).name, []):
+            digest.update(f"{filename} {data_hashes(filename)}".encode())
+    return digest.hexdigest()
+
+
+def convert(source, kind, output):
+    """Convert ``source`` into the ``kind`` notebook ``output``, as the Makefile does."""
+    remove_tag, _, execute = KINDS[kind]
+    stem = Path(source).stem
+    temp = f"{stem}_{kind}_temp.ipynb"
+    try:
+        subprocess.run(["jupytext", "--to", "ipynb", "-o", temp, source], check=True)
+        command = [
+            "jupyter", "nbconvert", "--to", "notebook", f"--output={output}",
+            "--TagRemovePreprocessor.enabled=True",
+            f'--TagRemovePreprocessor.remove_cell_tags=["{remove_tag}"]',
+            temp,
+        ]
+        if execute:
+            command.insert(4, "--execute")
+        subprocess.run(command, check=True)
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+
+
+def build_one(source, kind, key, notebooks, ready):
+    """Build one notebook, from the cache when possible. Returns a status line."""
+    suffix = KINDS[kind][1]
+    output = Path(ready) / f"{Path(source).stem}{suffix}.ipynb"
+    cached = Path(notebooks) / f"{key}.ipynb"
+    start = time.perf_counter()
+    if cached.exists():
+        shutil.copyfile(cached, output)
+        status = "cached"
+    else:
+        convert(source, kind, str(output))
+        atomic_write(cached, lambda f: f.write(output.read_bytes()))
+        status = "built"
+    return f"{status:>6} {output} ({time.perf_counter() - start:.1f} s)"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("sources", nargs="*", default=SOURCE_FILES)
+    parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count())
+    parser.add_argument("--ready", default="ready", help="output directory")
+    parser.add_argument("--cache-dir", type=Path, default=None)
+    parser.add_argument("--kinds", nargs="+", choices=sorted(KINDS), default=list(KINDS))
+    args = parser.parse_args(argv)
+
+    root = args.cache_dir or cache_dir()
+    notebooks = root / "notebooks"
+    notebooks.mkdir(parents=True, exist_ok=True)
+    Path(args.ready).mkdir(parents=True, exist_ok=True)
+    shutil.copytree("image", Path(args.ready) / "image", dirs_exist_ok=True)
+
+    data_hashes = DataHashes(root / "data-hashes.json")
+    tasks = [
+        (source, kind, build_key(source, kind, data_hashes))
+        for source in args.sources
+        for kind in args.kinds
+    ]
+    data_hashes.save()
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        futures = {
+            pool.submit(build_one, source, kind, key, notebooks, args.ready): (source, kind)
+            for source, kind, key in tasks
+        }
+        for future, (source, kind) in futures.items():
+            try:
+                print(future.result(), flush=True)
+            except subprocess.CalledProcessError as error:
+                failed += 1
+                print(f"failed {kind} notebook for {source}: {error}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
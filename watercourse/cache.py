@@ -0,0 +1,85 @@
+"""Location of, and safe writes into, the shared on-disk cache."""
+
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+
+# The process umask, read once: os.umask can only be read by setting it, which
+# is not safe once writer threads are running.
+_UMASK = os.umask(0o022)
+os.umask(_UMASK)
+
+
+def cache_dir(*parts):
+    """Return (and create) a directory inside the shared cache.
+
+    The cache lives in ``$WATERCOURSE_CACHE_DIR`` if set, otherwise in
+    ``~/.cache/water-course``.
+    """
+    root = os.environ.get("WATERCOURSE_CACHE_DIR")
+    path = Path(root) if root else Path.home() / ".cache" / "water-course"
+    path = path.joinpath(*parts)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def atomic_write(path, write):
+    """Write ``path`` through a temporary file that is renamed into place.
+
+    ``write`` is called with the open binary temporary file. Concurrent
+    writers (other processes, parallel builds) never see a partial file.
+    The file gets the usual permissions of a new file (``0o666`` less the
+    umask) rather than the ``0o600`` of the temporary file, so that tiles and
+    shared cache entries can be read by other users.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.chmod(tmp, 0o666 & ~_UMASK)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def file_hash(path, chunk_size=2**20):
+    """SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DataHashes:
+    """File hashes remembered across builds by path, size and modification time.
+
+    Large input files (the GRACE NetCDF is several hundred MB) are only
+    re-hashed when they change on disk.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        try:
+            self.entries = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def __call__(self, filename):
+        stat = os.stat(filename)
+        key = str(Path(filename).resolve())
+        entry = self.entries.get(key)
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return entry["sha256"]
+        sha256 = file_hash(filename)
+        self.entries[key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha256}
+        return sha256
+
+    def save(self):
+        data = json.dumps(self.entries, indent=1, sort_keys=True).encode()
+        atomic_write(self.path, lambda f: f.write(data))
@@ -0,0 +1,350 @@
+"""Dependency-aware partial re-execution of the tutorial scripts.
+
+Runs the solution version of a jupytext tutorial (code cells, without the
+``empty-cell`` ones) cell by cell, like the executed solution notebook, but
+re-runs only the cells affected by an edit.
+
+Each code cell is analysed with :mod:`ast` for the names it defines
+(assignments, ``for`` targets, imports, ``def``/``class``, and in-place stores
+such as ``pcp[i, j] = ...`` or ``data1.columns = ...``) and the names it uses.
+A cell depends on the latest earlier cell that defines each name it uses, and
+its cache key is the hash of the script's path, its own source, the contents
+of the data files it opens (string literals naming existing files, see
+:func:`data_files`) and the keys of those cells. Editing a cell or one of its
+input files therefore changes its key and the keys of every cell downstream
+of it, and nothing else; the same cell in another script has its own key.
+
+After a cell runs, the values of the names it defines are pickled to
+``<cache>/cells/<key>.pkl``. On the next run, a cell whose key has a snapshot
+is not executed; its values are loaded instead. Modules are stored by name
+and re-imported. Cells whose values cannot be pickled (e.g. an open
+``netCDF4.Dataset``) have no snapshot and always run.
+
+With ``WATERCOURSE_PROFILE`` set (see :mod:`watercourse.instrument`), every
+executed cell is timed under its processing stage, from a ``stage-<name>``
+tag, a ``# stage: <name>`` comment, or else the functions it calls
+(:func:`cell_stage`).
+
+Limitations: mutation through method calls (``df.drop(..., inplace=True)``)
+is not seen as a definition, and skipped cells produce no output or figures.
+
+Usage::
+
+    python -m watercourse.cells Ex1_Precipitation.py [--force] [--dry-run]
+"""
+
+import argparse
+import ast
+import builtins
+import hashlib
+import importlib
+import json
+import os
+import pickle
+import sys
+import time
+import types
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from .cache import DataHashes, atomic_write, cache_dir, file_hash
+from .instrument import stage
+
+_BUILTINS = set(dir(builtins))
+
+
+@dataclass
+class Cell:
+    """A code cell of a tutorial and its data-flow summary."""
+
+    index: int
+    source: str
+    defines: set = field(default_factory=set)
+    uses: set = field(default_factory=set)
+    parents: list = field(default_factory=list)
+    key: str = ""
+    tags: list = field(default_factory=list)
+
+
+def read_cells(path, drop_tag="empty-cell"):
+    """Code cells of a jupytext script, without those tagged ``drop_tag``."""
+    import jupytext
+
+    notebook = jupytext.read(path)
+    cells = [
+        cell for cell in notebook.cells
+        if cell.cell_type == "code" and drop_tag not in cell.metadata.get("tags", [])
+    ]
+    return [Cell(i, cell.source, tags=list(cell.metadata.get("tags", []))) for i, cell in enumerate(cells)]
+
+
+# Functions whose call puts a cell in a processing stage; the first stage that
+# matches, in this order, wins (a cell that plots and saves a map is "export",
+# one that also runs the IDW loop is "interpolate", with its savefig recorded
+# as a nested "export")
+STAGE_CALLS = {
+    "interpolate": {"IDW", "idw", "idw_grid", "griddata", "interp", "fill_gaps", "regrid"},
+    "qc": {"screen"},
+    "mask": {"within", "contains", "contains_xy", "basin_mask"},
+    "load": {"Dataset", "open_dataset", "open_mfdataset", "read_csv", "read_excel", "Reader",
+             "loadtxt", "load_rain_day"},
+    "aggregate": {"sum", "mean", "nansum", "nanmean", "resample", "groupby", "polyfit", "basin_mean",
+                  "trend_map", "rainfall_extremes", "lagged_correlation"},
+    "export": {"savefig", "imsave", "to_csv", "to_netcdf", "to_excel", "write_tiles"},
+    "render": {"figure", "subplots", "axes", "plot", "imshow", "pcolormesh", "contour", "contourf",
+               "scatter", "bar", "hist", "colorbar", "coastlines", "add_boundaries", "show"},
+}
+
+
+def cell_stage(cell):
+    """Processing stage of a cell, for :mod:`watercourse.instrument`.
+
+    A ``stage-<name>`` tag or a ``# stage: <name>`` comment decides;
+    otherwise the functions called by the cell's own statements (not inside
+    the functions it defines) are looked up in :data:`STAGE_CALLS`. Cells that
+    match nothing are ``"import"`` if they import modules, else ``"other"``
+    (definitions, small assignments).
+    """
+    for tag in cell.tags:
+        if tag.startswith("stage-"):
+            return tag[len("stage-"):]
+    for line in cell.source.splitlines():
+        if line.strip().startswith("# stage:"):
+            return line.split(":", 1)[1].strip()
+    try:
+        tree = ast.parse(cell.source)
+    except SyntaxError:
+        return "other"
+    called = set()
+    pending = list(tree.body)
+    while pending:
+        node = pending.pop()
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda)):
+            continue
+        if isinstance(node, ast.Call):
+            function = node.func
+            if isinstance(function, ast.Name):
+                called.add(function.id)
+            elif isinstance(function, ast.Attribute):
+                called.add(function.attr)
+        pending.extend(ast.iter_child_nodes(node))
+    fallback = "import" if any(isinstance(node, (ast.Import, ast.ImportFrom)) for node in tree.body) else "other"
+    return next((name for name, calls in STAGE_CALLS.items() if called & calls), fallback)
+
+
+def _target_names(target, defines, uses):
+    """Record the names bound (or modified in place) by an assignment target."""
+    if isinstance(target, ast.Name):
+        defines.add(target.id)
+    elif isinstance(target, (ast.Tuple, ast.List)):
+        for element in target.elts:
+            _target_names(element, defines, uses)
+    elif isinstance(target, ast.Starred):
+        _target_names(target.value, defines, uses)
+    elif isinstance(target, (ast.Subscript, ast.Attribute)):
+        # ``x[i] = ...`` / ``x.a = ...`` modify x: both a use and a definition
+        base = target.value
+        while isinstance(base, (ast.Subscript, ast.Attribute)):
+            base = base.value
+        if isinstance(base, ast.Name):
+            defines.add(base.id)
+            uses.add(base.id)
+
+
+def analyse(source):
+    """Names defined and used by a cell's source, or ``None`` if it does not parse.
+
+    A name counts as used only if it is read before the cell itself defines it.
+    """
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return None
+    defines, uses = set(), set()
+    for statement in tree.body:
+        stored, loaded = set(), set()
+        for node in ast.walk(statement):
+            if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load):
+                loaded.add(node.id)
+            elif isinstance(node, (ast.Assign, ast.AugAssign, ast.AnnAssign)):
+                targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+                for target in targets:
+                    _target_names(target, stored, loaded)
+                if isinstance(node, ast.AugAssign):
+                    _target_names(node.target, loaded, loaded)
+            elif isinstance(node, (ast.For, ast.AsyncFor)):
+                _target_names(node.target, stored, loaded)
+            elif isinstance(node, ast.withitem) and node.optional_vars is not None:
+                _target_names(node.optional_vars, stored, loaded)
+            elif isinstance(node, (ast.Import, ast.ImportFrom)):
+                for alias in node.names:
+                    stored.add((alias.asname or alias.name).split(".")[0])
+            elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                stored.add(node.name)
+            elif isinstance(node, ast.Global):
+                stored.update(node.names)
+        if isinstance(statement, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            stored = {statement.name}
+        uses |= (loaded - defines) - _BUILTINS
+        defines |= stored
+    return defines, uses
+
+
+def data_files(source, directory="."):
+    """Existing files named by string literals in a cell's source.
+
+    Paths are relative to ``directory`` (where the cell runs). A shapefile
+    brings its ``.dbf``/``.shx``/... companions, which ``Reader`` also reads.
+    """
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return []
+    files = set()
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Constant) and isinstance(node.value, str)) or "\n" in node.value:
+            continue
+        path = Path(directory) / node.value
+        try:
+            if not path.is_file():
+                continue
+        except (OSError, ValueError):
+            continue
+        files.add(path)
+        if path.suffix.lower() == ".shp":
+            files.update(p for p in path.parent.glob(f"{path.stem}.*") if p.is_file())
+    return sorted(files)
+
+
+def link(cells, script="", directory=".", hashes=file_hash):
+    """Fill in the dependencies and cache key of each cell, in order.
+
+    Args:
+      cells: cells from :func:`read_cells`.
+      script: path of the script, part of every key.
+      directory: where the cells run, for :func:`data_files`.
+      hashes: function returning the SHA-256 of a file.
+    """
+    script = str(Path(script).resolve()) if script else ""
+    provider = {}
+    everything = None  # cells that cannot be analysed depend on all earlier cells
+    for cell in cells:
+        result = analyse(cell.source)
+        if result is None:
+            cell.parents = sorted({c.index for c in provider.values()})
+            cell.defines = set(everything or ())
+        else:
+            cell.defines, cell.uses = result
+            cell.parents = sorted({provider[name].index for name in cell.uses if name in provider})
+        digest = hashlib.sha256(f"cell-v2\0{script}\0{cell.source}\0".encode())
+        for path in data_files(cell.source, directory):
+            digest.update(f"{path}\0{hashes(path)}\0".encode())
+        for parent in cell.parents:
+            digest.update(cells[parent].key.encode())
+        cell.key = digest.hexdigest()
+        for name in cell.defines:
+            provider[name] = cell
+        everything = set(provider)
+    return cells
+
+
+def _snapshot(namespace, names):
+    """Picklable form of ``namespace[names]``, or ``None`` if a value cannot be pickled."""
+    values = {}
+    for name in names:
+        if name not in namespace:
+            continue
+        value = namespace[name]
+        values[name] = ("module", value.__name__) if isinstance(value, types.ModuleType) else ("value", value)
+    try:
+        return pickle.dumps(values, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return None
+
+
+def _restore(data, namespace):
+    for name, (kind, value) in pickle.loads(data).items():
+        namespace[name] = importlib.import_module(value) if kind == "module" else value
+
+
+def run(path, store=None, force=False, dry_run=False, log=print):
+    """Run the solution cells of ``path``, re-using snapshots of unchanged cells.
+
+    Args:
+      path: jupytext tutorial source (e.g. ``Ex1_Precipitation.py``).
+      store: snapshot directory (default ``<cache>/cells``).
+      force: run every cell (and refresh the snapshots).
+      dry_run: only report which cells would run.
+      log: called with one status line per cell.
+
+    Returns:
+      The namespace after the last cell (empty for a dry run).
+    """
+    store = Path(store) if store else cache_dir("cells")
+    hashes = DataHashes(store / "hashes.json")
+    cells = link(read_cells(path), path, os.getcwd(), hashes)
+    hashes.save()
+    namespace = {"__name__": "__main__", "__file__": str(path)}
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    if os.environ.get("WATERCOURSE_FAST_START"):
+        from .faststart import enable
+
+        enable()
+    for cell in cells:
+        snapshot = store / f"{cell.key}.pkl"
+        cached = snapshot.exists() and not force
+        first_line = next((line for line in cell.source.splitlines() if line.strip()), "")
+        if dry_run:
+            log(f"{'cached' if cached else 'run':>6} [{cell.index:2d}] {first_line[:60]}")
+            continue
+        start = time.perf_counter()
+        if cached:
+            _restore(snapshot.read_bytes(), namespace)
+            status = "cached"
+        else:
+            with stage(cell_stage(cell)), stage(f"cell {cell.index:02d}"):
+                exec(compile(cell.source, f"<{path} cell {cell.index}>", "exec"), namespace)
+            data = _snapshot(namespace, cell.defines)
+            if data is not None:
+                atomic_write(snapshot, lambda f: f.write(data))
+            status = "ran"
+        log(f"{status:>6} [{cell.index:2d}] {time.perf_counter() - start:7.2f} s  {first_line[:60]}")
+
+    index = store / "index" / f"{hashlib.sha256(str(Path(path).resolve()).encode()).hexdigest()[:16]}.json"
+    keys = json.dumps([cell.key for cell in cells]).encode()
+    if not dry_run:
+        atomic_write(index, lambda f: f.write(keys))
+    return namespace
+
+
+def prune(store=None):
+    """Delete snapshots not used by the latest run of any script; returns the count."""
+    store = Path(store) if store else cache_dir("cells")
+    keep = set()
+    for index in (store / "index").glob("*.json"):
+        keep.update(json.loads(index.read_text()))
+    removed = 0
+    for snapshot in store.glob("*.pkl"):
+        if snapshot.stem not in keep:
+            snapshot.unlink()
+            removed += 1
+    return removed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("script", nargs="?")
+    parser.add_argument("--force", action="store_true", help="run every cell")
+    parser.add_argument("--dry-run", action="store_true", help="only show what would run")
+    parser.add_argument("--prune", action="store_true", help="delete unused snapshots")
+    parser.add_argument("--cache-dir", type=Path, default=None)
+    args = parser.parse_args(argv)
+    if args.script:
+        run(args.script, args.cache_dir, args.force, args.dry_run)
+    if args.prune:
+        print(f"removed {prune(args.cache_dir)} unused snapshots")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""Per-cell lagged correlation and regression between two gridded cubes.
+
+Relates, cell by cell, one ``(time, lat, lon)`` cube (e.g. monthly rainfall
+anomalies regridded with :mod:`watercourse.regrid`) to another on the same
+grid and time axis (e.g. GRACE water-storage anomalies from ``basics_02.py``),
+for a set of time lags.
+
+The cubes are read one chunk of time steps at a time and the means, variances
+and covariance are updated with the pairwise (Chan et al.) form of Welford's
+algorithm, so neither cube is ever held in memory as a whole and the result
+does not suffer from the cancellation of the naive sum-of-squares formulas.
+Each chunk is split into blocks of rows that are processed on a pool of
+threads; NumPy releases the GIL in the array arithmetic, so this uses all
+local cores.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+
+from .instrument import instrumented
+from .rainfall import read_block
+
+
+@dataclass
+class LaggedCorrelation:
+    """Result of :func:`lagged_correlation`, one map per lag.
+
+    Attributes:
+      lags: the lags, in time steps. ``y`` at ``t + lag`` is paired with ``x``
+        at ``t``, so positive lags mean ``y`` responds after ``x``.
+      correlation: ``(lag, lat, lon)`` Pearson correlation.
+      slope: ``(lag, lat, lon)`` least-squares slope of ``y`` on ``x``.
+      count: ``(lag, lat, lon)`` number of time steps where both were valid.
+    """
+
+    lags: np.ndarray
+    correlation: np.ndarray
+    slope: np.ndarray
+    count: np.ndarray
+
+
+class _Moments:
+    """Running count, means, second moments and co-moment per cell."""
+
+    def __init__(self, shape):
+        self.n = np.zeros(shape)
+        self.mean_x = np.zeros(shape)
+        self.mean_y = np.zeros(shape)
+        self.m2_x = np.zeros(shape)
+        self.m2_y = np.zeros(shape)
+        self.c_xy = np.zeros(shape)
+
+    def update(self, index, x, y):
+        """Merge the time series ``x``, ``y`` (``(time, ...)``) into cells ``index``."""
+        valid = np.isfinite(x) & np.isfinite(y)
+        x = np.where(valid, x, 0).astype(np.float64)
+        y = np.where(valid, y, 0).astype(np.float64)
+        nb = valid.sum(axis=0).astype(np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean_xb = np.where(nb > 0, x.sum(axis=0) / nb, 0)
+            mean_yb = np.where(nb > 0, y.sum(axis=0) / nb, 0)
+        dx = np.where(valid, x - mean_xb, 0)
+        dy = np.where(valid, y - mean_yb, 0)
+        m2_xb = (dx * dx).sum(axis=0)
+        m2_yb = (dy * dy).sum(axis=0)
+        c_xyb = (dx * dy).sum(axis=0)
+
+        na = self.n[index]
+        n = na + nb
+        with np.errstate(invalid="ignore", divide="ignore"):
+            weight = np.where(n > 0, nb / n, 0)
+        delta_x = mean_xb - self.mean_x[index]
+        delta_y = mean_yb - self.mean_y[index]
+        self.mean_x[index] += delta_x * weight
+        self.mean_y[index] += delta_y * weight
+        self.m2_x[index] += m2_xb + delta_x * delta_x * na * weight
+        self.m2_y[index] += m2_yb + delta_y * delta_y * na * weight
+        self.c_xy[index] += c_xyb + delta_x * delta_y * na * weight
+        self.n[index] = n
+
+
+def _row_blocks(nrows, nblocks):
+    edges = np.linspace(0, nrows, min(nblocks, nrows) + 1).astype(int)
+    return [slice(a, b) for a, b in zip(edges[:-1], edges[1:]) if b > a]
+
+
+@instrumented("aggregate")
+def lagged_correlation(x, y, lags=(0,), chunk_size=120, workers=None):
+    """Per-cell correlation and regression slope of ``y`` on ``x`` at several lags.
+
+    Args:
+      x, y: aligned ``(time, lat, lon)`` array-likes (ndarrays, masked arrays,
+        netCDF4 variables or :class:`watercourse.rainfall.PackedArray`).
+        Missing values are skipped pairwise.
+      lags: lags in time steps; ``y[t + lag]`` is paired with ``x[t]``.
+      chunk_size: number of time steps of ``x`` read at a time. ``y`` is read
+        over the same window widened by the range of ``lags``.
+      workers: number of threads (default: number of CPUs).
+
+    Returns:
+      A :class:`LaggedCorrelation`. Cells with fewer than two valid pairs, or
+      with zero variance, are NaN.
+    """
+    if tuple(x.shape) != tuple(y.shape):
+        raise ValueError(f"x and y must have the same shape, got {x.shape} and {y.shape}")
+    lags = np.atleast_1d(np.asarray(lags, dtype=int))
+    ntime, nrows = x.shape[0], x.shape[1]
+    moments = _Moments((len(lags),) + tuple(x.shape[1:]))
+    blocks = _row_blocks(nrows, workers or os.cpu_count() or 1)
+
+    with ThreadPoolExecutor(max_workers=len(blocks)) as pool:
+        for t0 in range(0, ntime, chunk_size):
+            t1 = min(t0 + chunk_size, ntime)
+            y0 = min(max(0, t0 + lags.min()), ntime)
+            y1 = max(min(ntime, t1 + lags.max()), y0)
+            xb = read_block(x, t0, t1)
+            yb = read_block(y, y0, y1)
+
+            def update(rows):
+                for k, lag in enumerate(lags):
+                    start, stop = max(t0, -lag), min(t1, ntime - lag)
+                    if start >= stop:
+                        continue
+                    moments.update(
+                        (k, rows),
+                        xb[start - t0:stop - t0, rows],
+                        yb[start + lag - y0:stop + lag - y0, rows],
+                    )
+
+            list(pool.map(update, blocks))
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        correlation = moments.c_xy / np.sqrt(moments.m2_x * moments.m2_y)
+        slope = moments.c_xy / moments.m2_x
+    too_few = moments.n < 2
+    correlation[too_few] = np.nan
+    slope[too_few] = np.nan
+    return LaggedCorrelation(lags, correlation, slope, moments.n.astype(np.int64))
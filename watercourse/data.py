@@ -0,0 +1,274 @@
+"""Checksummed, resumable cache of the datasets downloaded by the Makefile.
+
+The files the tutorials read are listed in ``data_manifest.json`` with their
+expected SHA-256 and size. :func:`fetch` makes a verified copy available in
+the working directory:
+
+1. a file already in place is kept if it matches the manifest (its hash is
+   remembered by size and modification time, so it is not re-read on every
+   build);
+2. otherwise it is copied from the shared content-addressed cache
+   (``<cache>/data/sha256/<hash>``, see :func:`watercourse.cache.cache_dir`);
+3. otherwise it is downloaded into the cache, resuming an interrupted download
+   with an HTTP range request, verified, and then copied.
+
+The files are downloaded from ``$WATERCOURSE_DATA_MIRROR`` if set, otherwise
+from the manifest's ``base_url``. The mirror may be a local directory, so that
+builds and tests can run fully offline.
+
+Manifest entries without a ``sha256`` are pinned on first download: the hash
+of the file downloaded into the cache is stored there and later fetches are
+verified against it. Files found in the working directory are never pinned;
+until an entry is pinned, a local copy is replaced by a fresh download, and
+``verify`` reports it as unpinned. With ``--strict`` (or
+``WATERCOURSE_DATA_STRICT=1``) nothing is pinned: entries without a checksum
+in the manifest are refused.
+
+``python -m watercourse.data manifest`` prints the entries of the files in
+the working directory; ``--write`` records them in ``data_manifest.json``.
+After adding a file to the manifest, run ``fetch`` and ``manifest --write``
+once from a machine that can reach ``base_url``, and commit the result.
+
+Usage::
+
+    python -m watercourse.data fetch [NAME ...] [--strict]
+    python -m watercourse.data verify [NAME ...]
+    python -m watercourse.data manifest [NAME ...] [--write]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import urllib.error
+import urllib.request
+import zipfile
+from pathlib import Path
+
+from .cache import DataHashes, atomic_write, cache_dir, file_hash
+
+MANIFEST = Path(__file__).with_name("data_manifest.json")
+
+
+class ChecksumError(RuntimeError):
+    """A file does not match its expected size or checksum."""
+
+
+def load_manifest(path=MANIFEST):
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(manifest, path=MANIFEST):
+    text = json.dumps(manifest, indent=2) + "\n"
+    atomic_write(path, lambda f: f.write(text.encode()))
+
+
+class DataCache:
+    """Content-addressed store of downloaded files.
+
+    Args:
+      root: cache directory (default ``<cache>/data``).
+      mirror: directory or base URL to download from (default
+        ``$WATERCOURSE_DATA_MIRROR``, then the manifest's ``base_url``).
+      manifest: parsed manifest (default ``data_manifest.json``).
+      strict: refuse entries without a checksum in the manifest instead of
+        pinning them (default ``$WATERCOURSE_DATA_STRICT``).
+    """
+
+    def __init__(self, root=None, mirror=None, manifest=None, strict=None):
+        self.root = Path(root) if root else cache_dir("data")
+        self.manifest = manifest or load_manifest()
+        self.mirror = mirror or os.environ.get("WATERCOURSE_DATA_MIRROR") or self.manifest["base_url"]
+        if strict is None:
+            strict = os.environ.get("WATERCOURSE_DATA_STRICT", "") not in ("", "0")
+        self.strict = strict
+        self.hashes = DataHashes(self.root / "hashes.json")
+        self.pins_path = self.root / "pins.json"
+        try:
+            self.pins = json.loads(self.pins_path.read_text())
+        except (OSError, ValueError):
+            self.pins = {}
+
+    def entry(self, name):
+        try:
+            entry = dict(self.manifest["files"][name])
+        except KeyError:
+            raise KeyError(f"{name} is not in the data manifest") from None
+        if entry.get("sha256") is None and name in self.pins and not self.strict:
+            entry.update(self.pins[name])
+        return entry
+
+    def blob(self, sha256):
+        return self.root / "sha256" / sha256
+
+    def verify(self, name, path):
+        """Raise :class:`ChecksumError` unless ``path`` matches the entry for ``name``."""
+        entry = self.entry(name)
+        size = os.path.getsize(path)
+        if entry.get("size") is not None and size != entry["size"]:
+            raise ChecksumError(f"{path}: size {size} does not match {entry['size']} for {name}")
+        if entry.get("sha256") is not None:
+            sha256 = self.hashes(path)
+            if sha256 != entry["sha256"]:
+                raise ChecksumError(f"{path}: sha256 {sha256} does not match {entry['sha256']} for {name}")
+
+    def is_valid(self, name, path):
+        if not os.path.exists(path):
+            return False
+        try:
+            self.verify(name, path)
+        except ChecksumError:
+            return False
+        return self.entry(name).get("sha256") is not None
+
+    def _download(self, name, partial):
+        """Download ``name`` from the mirror into ``partial``, resuming if possible."""
+        if "://" not in self.mirror:
+            shutil.copyfile(Path(self.mirror) / name, partial)
+            return
+        url = self.mirror.rstrip("/") + "/" + name
+        offset = partial.stat().st_size if partial.exists() else 0
+        request = urllib.request.Request(url)
+        if offset:
+            request.add_header("Range", f"bytes={offset}-")
+        try:
+            response = urllib.request.urlopen(request)
+        except urllib.error.HTTPError as error:
+            if error.code != 416:  # 416: the partial file is already complete (or stale)
+                raise
+            if self.entry(name).get("size") == offset:
+                return
+            partial.unlink()
+            return self._download(name, partial)
+        resumed = response.status == 206
+        with response, open(partial, "ab" if resumed else "wb") as f:
+            shutil.copyfileobj(response, f, length=2**20)
+            length = response.headers.get("Content-Length")
+        # an unpinned entry has no size to check, so at least make sure the
+        # whole response arrived before its hash can be pinned
+        if length is not None and partial.stat().st_size != int(length) + (offset if resumed else 0):
+            raise ChecksumError(f"{name}: incomplete download from {url}; run fetch again to resume")
+
+    def pin(self, name, path):
+        """Record the hash of ``path`` as the expected one for an unpinned ``name``."""
+        sha256 = self.hashes(path)
+        print(f"warning: {name} has no checksum in the manifest; pinning sha256 {sha256}",
+              file=sys.stderr)
+        self.pins[name] = {"sha256": sha256, "size": os.path.getsize(path)}
+        pins = json.dumps(self.pins, indent=1, sort_keys=True).encode()
+        atomic_write(self.pins_path, lambda f: f.write(pins))
+
+    def get(self, name):
+        """Path of a verified copy of ``name`` in the cache, downloading it if needed."""
+        entry = self.entry(name)
+        if self.strict and entry.get("sha256") is None:
+            raise ChecksumError(f"{name} has no checksum in the manifest; fetch it without --strict, then "
+                                f"record it with 'python -m watercourse.data manifest --write {name}'")
+        if entry.get("sha256") is not None and self.blob(entry["sha256"]).exists():
+            blob = self.blob(entry["sha256"])
+            if self.is_valid(name, blob):
+                return blob
+            blob.unlink()
+
+        partial = self.root / "partial" / f"{name}.part"
+        partial.parent.mkdir(parents=True, exist_ok=True)
+        print(f"Downloading {name} from {self.mirror}...", file=sys.stderr)
+        self._download(name, partial)
+        try:
+            self.verify(name, partial)
+        except ChecksumError:
+            partial.unlink()
+            raise
+        sha256 = self.hashes(partial)
+        if entry.get("sha256") is None:
+            self.pin(name, partial)
+        blob = self.blob(sha256)
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(partial, blob)
+        self.hashes.save()
+        return blob
+
+    def fetch(self, name, directory="."):
+        """Make a verified ``directory/name`` available; returns its path."""
+        target = Path(directory) / name
+        # an unpinned entry is never valid, so a local file of unknown origin
+        # (e.g. a truncated download) is replaced by a verified download
+        if not self.is_valid(name, target):
+            # copied rather than hard-linked, so that editing the working
+            # copy can never corrupt the cache
+            blob = self.get(name)
+
+            def copy(f):
+                with open(blob, "rb") as source:
+                    shutil.copyfileobj(source, f, 2**20)
+
+            atomic_write(target, copy)
+        if self.entry(name).get("extract"):
+            extract(target, self.hashes(target))
+        self.hashes.save()
+        return target
+
+
+def extract(path, sha256):
+    """Extract a zip file next to itself, unless this exact file was already extracted.
+
+    The stamp file records the zip's hash and its members; the zip is
+    extracted again if it changed or any of the members is missing.
+    """
+    path = Path(path)
+    stamp = path.parent / f".{path.name}.extracted"
+    try:
+        done = json.loads(stamp.read_text())
+    except (OSError, ValueError):
+        done = {}
+    if done.get("sha256") == sha256 and all((path.parent / member).exists() for member in done.get("members", [])):
+        return
+    with zipfile.ZipFile(path) as archive:
+        members = archive.namelist()
+        archive.extractall(path.parent)
+    stamp.write_text(json.dumps({"sha256": sha256, "members": members}))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=["fetch", "verify", "manifest"])
+    parser.add_argument("names", nargs="*")
+    parser.add_argument("--directory", default=".")
+    parser.add_argument("--mirror", default=None, help="directory or base URL to download from")
+    parser.add_argument("--strict", action="store_true", default=None,
+                        help="refuse files without a checksum in the manifest")
+    parser.add_argument("--write", action="store_true", help="record the entries in data_manifest.json")
+    args = parser.parse_args(argv)
+
+    cache = DataCache(mirror=args.mirror, strict=args.strict)
+    names = args.names or list(cache.manifest["files"])
+    status = 0
+    for name in names:
+        path = Path(args.directory) / name
+        if args.command == "fetch":
+            cache.fetch(name, args.directory)
+        elif args.command == "verify":
+            try:
+                cache.verify(name, path)
+                if cache.entry(name).get("sha256") is None:
+                    print(f"UNPINNED {path}: no checksum yet; run fetch to download a verified copy")
+                    status = 1
+                else:
+                    print(f"ok      {path}")
+            except (ChecksumError, OSError) as error:
+                print(f"FAILED  {error}")
+                status = 1
+        else:
+            entry = {"sha256": file_hash(path), "size": path.stat().st_size}
+            print(f'"{name}": {json.dumps(entry)},')
+            cache.manifest["files"].setdefault(name, {}).update(entry)
+    if args.command == "manifest" and args.write:
+        write_manifest(cache.manifest)
+    cache.hashes.save()
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
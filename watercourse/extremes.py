@@ -0,0 +1,188 @@
+"""Percentile climatology and annual maxima of a daily rainfall cube.
+
+A per-cell ``np.percentile`` over a century of daily ``rain_day`` grids needs
+the whole cube in memory and sorts every cell. Instead, each cell here keeps a
+logarithmic histogram (a DDSketch-style quantile sketch) that is filled one
+chunk of time steps at a time, and the annual-maximum series is reduced in the
+same pass.
+
+Error bound: for values of at least ``min_value`` the returned percentile is
+within a relative error of ``relative_accuracy`` of the exact order statistic
+(``np.percentile(..., method="lower")``). Values below ``min_value`` are
+counted as zero, so percentiles that fall among them are returned as 0 with an
+absolute error below ``min_value``. Values above ``max_value`` are counted in
+the top bucket. Annual maxima are exact.
+
+Memory: the sketch uses ``2`` bytes (``4`` for records longer than 65535
+steps) per cell and bucket. With the defaults (1 % accuracy, 0.1 mm to
+2000 mm) that is about 500 buckets, so the grid is processed in bands of rows
+that keep the histograms under ``memory_limit`` bytes; each band is a separate
+pass over time.
+"""
+
+import math
+from dataclasses import dataclass
+
+import numpy as np
+
+from .instrument import instrumented
+from .rainfall import read_block
+from .resample import GroupAggregator, group_starts
+
+# entries of the int64 bucket counts of one np.bincount call in QuantileSketch.add
+_BINCOUNT_SIZE = 2**17
+
+
+@dataclass
+class Extremes:
+    """Result of :func:`rainfall_extremes`.
+
+    Attributes:
+      quantiles: the requested quantiles, in ``[0, 1]``.
+      percentiles: ``(quantile, lat, lon)`` estimated percentiles.
+      years: labels of the annual-maximum series.
+      annual_max: ``(year, lat, lon)`` annual maxima.
+      count: ``(lat, lon)`` number of values in each cell's sketch.
+    """
+
+    quantiles: np.ndarray
+    percentiles: np.ndarray
+    years: np.ndarray
+    annual_max: np.ndarray
+    count: np.ndarray
+
+
+class QuantileSketch:
+    """Logarithmic-bucket histograms for a set of cells.
+
+    Bucket 0 holds values below ``min_value``; bucket ``k + 1`` holds values in
+    ``(min_value * gamma**(k - 1), min_value * gamma**k]`` with
+    ``gamma = (1 + a) / (1 - a)``, whose midpoint in the DDSketch sense is
+    within a relative error ``a`` of every value in the bucket.
+
+    ``counts`` has shape ``(nbuckets, ncells)``.
+    """
+
+    def __init__(self, ncells, relative_accuracy=0.01, min_value=0.1, max_value=2000.0,
+                 dtype=np.uint16):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy must be between 0 and 1")
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.min_value = min_value
+        self.nbuckets = math.ceil(math.log(max_value / min_value) / self.log_gamma) + 2
+        self.counts = np.zeros((self.nbuckets, ncells), dtype=dtype)
+
+    @staticmethod
+    def nbytes(ncells, relative_accuracy=0.01, min_value=0.1, max_value=2000.0, dtype=np.uint16):
+        """Size of the histograms for ``ncells`` cells, without allocating them."""
+        gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        nbuckets = math.ceil(math.log(max_value / min_value) / math.log(gamma)) + 2
+        return ncells * nbuckets * np.dtype(dtype).itemsize
+
+    def add(self, block):
+        """Add a ``(time, ncells)`` block of values; NaNs are ignored."""
+        nbuckets, ncells = self.counts.shape
+        # buckets are counted with np.bincount over a few cells at a time, so
+        # that its int64 histograms stay small and in cache
+        step = max(1, _BINCOUNT_SIZE // nbuckets)
+        for c0 in range(0, ncells, step):
+            c1 = min(c0 + step, ncells)
+            part = block[:, c0:c1]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                x = np.divide(part, self.min_value)
+                np.log(x, out=x)
+                x /= self.log_gamma
+            np.ceil(x, out=x)
+            x += 1
+            # fmax also maps the NaN of negative values to bucket 0
+            np.fmax(x, 0, out=x)
+            np.minimum(x, nbuckets - 1, out=x)
+            x *= part >= self.min_value
+            bucket = x.astype(np.intp)
+            bucket *= c1 - c0
+            bucket += np.arange(c1 - c0)
+            # non-finite values go to one extra bin past the histograms
+            size = nbuckets * (c1 - c0)
+            np.copyto(bucket, size, where=~np.isfinite(part))
+            added = np.bincount(bucket.ravel(), minlength=size + 1)[:size]
+            self.counts[:, c0:c1] += added.reshape(nbuckets, c1 - c0).astype(self.counts.dtype)
+
+    def quantile(self, q, wet_only=False):
+        """Estimated ``q`` quantile of each cell (``method="lower"`` ranks).
+
+        ``q`` may be a sequence, giving an array of shape ``(len(q), ncells)``.
+        With ``wet_only`` the values below ``min_value`` are left out.
+        """
+        n = self.counts.sum(axis=0, dtype=np.int64)
+        if wet_only:
+            n -= self.counts[0]
+        ranks = np.floor(np.multiply.outer(np.atleast_1d(q), n - 1)).astype(np.int64)
+        # the cumulative counts only grow, so the bucket holding a rank is the
+        # number of buckets whose cumulative count does not exceed it; adding
+        # them up a row at a time avoids a (nbuckets, ncells) cumulative array
+        bucket = np.zeros(ranks.shape, dtype=np.min_scalar_type(self.nbuckets))
+        cumulative = np.zeros(n.shape, dtype=np.int64)
+        for k in range(len(self.counts)):
+            if k or not wet_only:
+                cumulative += self.counts[k]
+            bucket += cumulative <= ranks
+        value = self.min_value * 2 * self.gamma ** (bucket - 1.0) / (self.gamma + 1)
+        value = np.where(bucket == 0, 0.0, value)
+        out = np.where(n > 0, value, np.nan)
+        return out if np.ndim(q) else out[0]
+
+
+@instrumented("aggregate")
+def rainfall_extremes(cube, dates, quantiles=(0.95, 0.99), relative_accuracy=0.01,
+                      min_value=0.1, max_value=2000.0, wet_only=False, chunk_size=366,
+                      memory_limit=256 * 2**20):
+    """Per-cell percentiles and annual maxima of a ``(time, lat, lon)`` cube.
+
+    Args:
+      cube: daily rainfall; anything :func:`watercourse.rainfall.read_block`
+        accepts (ndarray, masked array, netCDF4 variable, ``PackedArray``).
+      dates: ``datetime64`` dates of the time steps
+        (:func:`watercourse.resample.decode_time`).
+      quantiles: quantiles to estimate, in ``[0, 1]``.
+      relative_accuracy: relative error bound of the percentiles.
+      min_value, max_value: range of values resolved by the sketch (mm).
+      wet_only: compute percentiles over wet days (``>= min_value``) only.
+      chunk_size: number of time steps read at a time.
+      memory_limit: upper bound (bytes) on the histograms held at once.
+
+    Returns:
+      An :class:`Extremes`.
+    """
+    ntime, nrows = cube.shape[0], cube.shape[1]
+    cells_per_row = int(np.prod(cube.shape[2:], dtype=np.int64))
+    dtype = np.uint16 if ntime < 2**16 else np.uint32
+    row_bytes = QuantileSketch.nbytes(cells_per_row, relative_accuracy, min_value, max_value, dtype)
+    rows_per_pass = max(1, min(nrows, memory_limit // row_bytes))
+
+    quantiles = np.atleast_1d(np.asarray(quantiles, dtype=np.float64))
+    starts, years = group_starts(dates, "year")
+    spatial = tuple(cube.shape[1:])
+    percentiles = np.empty((len(quantiles),) + spatial, dtype=np.float32)
+    annual_max = np.empty((len(starts),) + spatial, dtype=np.float32)
+    count = np.empty(spatial, dtype=np.int64)
+
+    for r0 in range(0, nrows, rows_per_pass):
+        rows = slice(r0, min(r0 + rows_per_pass, nrows))
+        band = (rows.stop - r0,) + spatial[1:]
+        sketch = QuantileSketch(band[0] * cells_per_row, relative_accuracy, min_value,
+                                max_value, dtype)
+        maxima = GroupAggregator(starts, ntime, "max", annual_max[:, rows])
+        for t0 in range(0, ntime, chunk_size):
+            t1 = min(t0 + chunk_size, ntime)
+            block = read_block(cube, t0, t1, rows)
+            sketch.add(block.reshape(t1 - t0, -1))
+            maxima.add(t0, block)
+        maxima.close()
+        percentiles[:, rows] = sketch.quantile(quantiles, wet_only).reshape((len(quantiles),) + band)
+        total = sketch.counts.sum(axis=0, dtype=np.int64)
+        if wet_only:
+            total -= sketch.counts[0]
+        count[rows] = total.reshape(band)
+
+    return Extremes(quantiles, percentiles, years, annual_max, count)
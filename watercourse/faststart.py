@@ -0,0 +1,196 @@
+"""Fast-start mode for running the tutorial scripts as batch jobs.
+
+Each tutorial imports its plotting and GIS stack at the top (cartopy in
+``basics_00.py``, netCDF4/shapely/pyshp in ``basics_01.py``, xarray in
+``basics_02.py``, seaborn in ``Ex1_Precipitation.py``). On short-lived
+workers that import time is a noticeable part of the run. In fast-start mode:
+
+- ``import x`` of the heavy packages in :data:`LAZY_MODULES` returns a module
+  that is only executed when one of its attributes is first used
+  (:class:`importlib.util.LazyLoader`). ``from x import y`` still loads ``x``
+  straight away, since ``y`` is needed at once.
+- In headless runs (no ``$DISPLAY``, or ``$MPLBACKEND`` set to ``Agg``),
+  matplotlib uses the Agg backend and seaborn's styling calls (``sns.set()``,
+  ``sns.set_context(...)``, ...) are skipped; seaborn itself is only imported
+  if something else from it is used.
+
+Usage::
+
+    python -m watercourse.faststart SCRIPT [ARGS ...]
+    python -m watercourse.faststart --measure [SCRIPT ...]
+
+``WATERCOURSE_FAST_START=1`` enables the same mode in
+:mod:`watercourse.cells`.
+"""
+
+import argparse
+import ast
+import importlib
+import importlib.abc
+import importlib.machinery
+import importlib.util
+import json
+import os
+import runpy
+import subprocess
+import sys
+import types
+
+# Only these modules themselves are made lazy, not their submodules: once a
+# package does load, its own imports run normally, which keeps packages with
+# circular internal imports (pandas, xarray) working.
+LAZY_MODULES = {
+    "cartopy", "cartopy.crs", "matplotlib.pyplot", "netCDF4", "pandas",
+    "seaborn", "shapefile", "shapely", "shapely.geometry", "xarray",
+}
+
+STYLE_FUNCTIONS = {"set", "set_theme", "set_context", "set_style", "set_palette", "set_color_codes"}
+
+
+def is_headless():
+    """True when figures can only be saved, not shown."""
+    backend = os.environ.get("MPLBACKEND", "").lower()
+    if backend:
+        return backend in ("agg", "pdf", "svg", "ps", "cairo", "template")
+    return sys.platform.startswith("linux") and not (
+        os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY")
+    )
+
+
+class _LazyFinder(importlib.abc.MetaPathFinder):
+    """Wraps the listed pure-Python modules in a ``LazyLoader``."""
+
+    def __init__(self, names):
+        self.names = set(names)
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname not in self.names:
+            return None
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        if isinstance(spec.loader, importlib.machinery.SourceFileLoader):
+            spec.loader = importlib.util.LazyLoader(spec.loader)
+        return spec
+
+
+class _DeferredSeaborn(types.ModuleType):
+    """Stand-in for seaborn in headless runs: styling is a no-op, anything else imports seaborn."""
+
+    def __getattr__(self, name):
+        if name in STYLE_FUNCTIONS:
+            return lambda *args, **kwargs: None
+        if sys.modules.get("seaborn") is self:
+            del sys.modules["seaborn"]
+        module = importlib.import_module("seaborn")
+        self.__dict__.update(module.__dict__)
+        return getattr(module, name)
+
+
+_enabled = False
+
+
+def enable(names=LAZY_MODULES, headless=None):
+    """Switch the current interpreter to fast-start mode (idempotent)."""
+    global _enabled
+    if _enabled:
+        return
+    _enabled = True
+    if headless is None:
+        headless = is_headless()
+    if headless:
+        os.environ.setdefault("MPLBACKEND", "Agg")
+        if "seaborn" not in sys.modules:
+            sys.modules["seaborn"] = _DeferredSeaborn("seaborn")
+    sys.meta_path.insert(0, _LazyFinder(names))
+
+
+def script_imports(path):
+    """Source of the module-level import statements of a script, in order."""
+    with open(path) as f:
+        tree = ast.parse(f.read())
+    return "\n".join(
+        ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))
+    )
+
+
+_MEASURE = """
+import json, sys, time
+fast = sys.argv[1] == "fast"
+start = time.perf_counter()
+if fast:
+    import watercourse.faststart
+    watercourse.faststart.enable(headless=True)
+try:
+    exec(sys.argv[2], {})
+    error = None
+except Exception as exc:
+    error = f"{type(exc).__name__}: {exc}"
+print(json.dumps({"seconds": time.perf_counter() - start, "error": error}))
+"""
+
+
+def measure(path, repeat=3):
+    """Cold-start import time of a script, eager and in fast-start mode.
+
+    Each measurement runs the script's import statements in a fresh
+    interpreter; the best of ``repeat`` runs is kept.
+    """
+    imports = script_imports(path)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get("PYTHONPATH")])))
+    result = {"script": str(path)}
+    for mode in ("eager", "fast"):
+        runs = []
+        for _ in range(repeat):
+            output = subprocess.run(
+                [sys.executable, "-c", _MEASURE, mode, imports],
+                capture_output=True, text=True, check=True, env=env,
+            )
+            runs.append(json.loads(output.stdout))
+        result[mode] = min(run["seconds"] for run in runs)
+        if runs[0]["error"]:
+            result[f"{mode}_error"] = runs[0]["error"]
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--measure", action="store_true",
+                        help="report cold-start import time of the scripts")
+    parser.add_argument("--json", action="store_true", help="print the measurements as JSON")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("script", nargs="*")
+    args, extra = parser.parse_known_args(argv)
+
+    if args.measure:
+        from .build import SOURCE_FILES
+
+        results = [measure(path, args.repeat) for path in args.script or SOURCE_FILES]
+        if args.json:
+            print(json.dumps(results, indent=1))
+        else:
+            print(f"{'script':<24} {'eager (s)':>10} {'fast (s)':>10}")
+            for result in results:
+                errors = "; ".join(v for k, v in result.items() if k.endswith("_error"))
+                print(f"{result['script']:<24} {result['eager']:10.3f} {result['fast']:10.3f}  {errors}")
+        return 0
+
+    if not args.script:
+        parser.error("a script to run is required")
+    from .instrument import stage
+
+    enable()
+    sys.argv = args.script + extra
+    with stage("script"):
+        runpy.run_path(args.script[0], run_name="__main__")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
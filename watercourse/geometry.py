@@ -0,0 +1,188 @@
+"""Cached, pre-projected boundary geometry for map rendering.
+
+``basics_00.py`` draws ``ax.coastlines()`` and ``basics_01.py`` reads and plots
+the MDB boundary shapefiles. When many maps are drawn, loading, clipping and
+projecting the same Natural Earth or shapefile geometry for every figure costs
+more than plotting the data. Here each boundary is prepared once per
+(source, projection, extent, resolution):
+
+1. loaded in longitude/latitude,
+2. clipped to the map extent,
+3. projected to the map projection,
+4. simplified to the size of one screen pixel, and
+5. converted to matplotlib paths.
+
+The prepared paths are kept in memory and in the shared on-disk cache
+(``<cache>/geometry``), so other figures and other worker processes re-use
+them.
+
+Example::
+
+    ax = plt.axes(projection=ccrs.PlateCarree())
+    add_boundaries(ax, "coastline")          # instead of ax.coastlines()
+    add_boundaries(ax, "MDB_boundaries/MDB_north_boundary.shp", edgecolor="C1")
+"""
+
+import hashlib
+import io
+import os
+
+import numpy as np
+
+from .cache import atomic_write, cache_dir
+from .instrument import instrumented
+
+_memory = {}
+
+
+def _source_id(source, resolution):
+    """Identity of a geometry source, including the file's size and mtime."""
+    if source == "coastline":
+        return f"naturalearth-coastline-{resolution}"
+    stat = os.stat(source)
+    return f"{os.path.abspath(source)}-{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def load_geometries(source, resolution="110m"):
+    """Shapely geometries (lon/lat) of ``"coastline"`` or a shapefile path."""
+    if source == "coastline":
+        from cartopy.io import shapereader
+
+        source = shapereader.natural_earth(resolution=resolution, category="physical", name="coastline")
+    from shapefile import Reader
+    from shapely.geometry import shape
+
+    with Reader(source) as reader:
+        return [shape(item) for item in reader.shapes()]
+
+
+def _rings(geometry):
+    """Coordinate sequences of a geometry, and whether each one is closed."""
+    kind = geometry.geom_type
+    if kind in ("LineString", "LinearRing"):
+        yield np.asarray(geometry.coords), kind == "LinearRing"
+    elif kind == "Polygon":
+        yield np.asarray(geometry.exterior.coords), True
+        for interior in geometry.interiors:
+            yield np.asarray(interior.coords), True
+    elif hasattr(geometry, "geoms"):
+        for part in geometry.geoms:
+            yield from _rings(part)
+
+
+def _to_arrays(geometries):
+    """Concatenated vertices and matplotlib path codes of the geometries' outlines."""
+    from matplotlib.path import Path
+
+    vertices, codes = [], []
+    for geometry in geometries:
+        for coords, closed in _rings(geometry):
+            if len(coords) < 2:
+                continue
+            ring_codes = np.full(len(coords), Path.LINETO, dtype=np.uint8)
+            ring_codes[0] = Path.MOVETO
+            if closed:
+                ring_codes[-1] = Path.CLOSEPOLY
+            vertices.append(coords[:, :2])
+            codes.append(ring_codes)
+    if not vertices:
+        return np.empty((0, 2)), np.empty(0, dtype=np.uint8)
+    return np.concatenate(vertices), np.concatenate(codes)
+
+
+def _projection_id(projection):
+    return "lonlat" if projection is None else projection.proj4_init
+
+
+def prepare(source, projection=None, extent=None, resolution="110m", pixels=1000):
+    """Clipped, projected and simplified outline of a boundary source.
+
+    Args:
+      source: ``"coastline"`` (Natural Earth, needs cartopy) or the path of a
+        lon/lat shapefile.
+      projection: cartopy CRS of the map, or ``None`` for plain lon/lat axes
+        like those in ``basics_01.py``.
+      extent: ``(lon0, lon1, lat0, lat1)`` of the map; ``None`` for the whole
+        geometry.
+      resolution: Natural Earth resolution (``"110m"``, ``"50m"``, ``"10m"``).
+      pixels: width of the map in pixels; the outline is simplified to a
+        tolerance of one pixel.
+
+    Returns:
+      ``(vertices, codes)`` arrays of a single matplotlib path in projected
+      coordinates.
+    """
+    key_text = "geometry-v1|{}|{}|{}|{}".format(
+        _source_id(source, resolution),
+        _projection_id(projection),
+        None if extent is None else tuple(round(float(v), 6) for v in extent),
+        int(pixels),
+    )
+    key = hashlib.sha256(key_text.encode()).hexdigest()[:32]
+    if key in _memory:
+        return _memory[key]
+    path = cache_dir("geometry") / f"{key}.npz"
+    if path.exists():
+        with np.load(path) as cached:
+            _memory[key] = cached["vertices"], cached["codes"]
+        return _memory[key]
+
+    import shapely
+
+    geometries = load_geometries(source, resolution)
+    if extent is not None:
+        lon0, lon1, lat0, lat1 = extent
+        geometries = [shapely.clip_by_rect(g, lon0, lat0, lon1, lat1) for g in geometries]
+        geometries = [g for g in geometries if not g.is_empty]
+    if projection is not None:
+        import cartopy.crs as ccrs
+
+        lonlat = ccrs.PlateCarree()
+        geometries = [projection.project_geometry(g, lonlat) for g in geometries]
+    if geometries:
+        x0, y0, x1, y1 = shapely.total_bounds(geometries)
+        tolerance = max(x1 - x0, y1 - y0) / pixels
+        geometries = [g.simplify(tolerance, preserve_topology=False) for g in geometries]
+
+    vertices, codes = _to_arrays(geometries)
+
+    def write(f):
+        buffer = io.BytesIO()
+        np.savez(buffer, vertices=vertices, codes=codes)
+        f.write(buffer.getvalue())
+
+    atomic_write(path, write)
+    _memory[key] = vertices, codes
+    return vertices, codes
+
+
+@instrumented("render")
+def add_boundaries(ax, source="coastline", resolution="110m", extent=None, **kwargs):
+    """Draw a cached boundary on ``ax``; extra keywords go to ``PathCollection``.
+
+    ``ax`` may be a cartopy ``GeoAxes`` (the geometry is projected to its
+    projection and clipped to its current extent) or ordinary lon/lat axes.
+    """
+    from matplotlib.collections import PathCollection
+    from matplotlib.path import Path
+
+    projection = getattr(ax, "projection", None)
+    if extent is None and projection is not None and not _is_global(ax):
+        import cartopy.crs as ccrs
+
+        extent = ax.get_extent(ccrs.PlateCarree())
+    pixels = max(1, int(ax.bbox.width))
+    vertices, codes = prepare(source, projection, extent, resolution, pixels)
+    kwargs.setdefault("facecolor", "none")
+    kwargs.setdefault("edgecolor", "black")
+    collection = PathCollection([Path(vertices, codes)], transform=ax.transData, **kwargs)
+    ax.add_collection(collection, autolim=projection is None)
+    if projection is None:
+        ax.autoscale_view()
+    return collection
+
+
+def _is_global(ax):
+    x0, x1, y0, y1 = ax.get_extent()
+    gx0, gx1, gy0, gy1 = (*ax.projection.x_limits, *ax.projection.y_limits)
+    return np.allclose((x0, x1, y0, y1), (gx0, gx1, gy0, gy1))
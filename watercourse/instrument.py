@@ -0,0 +1,195 @@
+"""Lightweight per-stage instrumentation of the processing steps.
+
+The tutorials go through the same stages: load -> (qc ->) mask -> aggregate ->
+interpolate -> render -> export. Two kinds of code are recorded:
+
+- the tutorials themselves, when run with ``python -m watercourse.cells``:
+  every executed cell is recorded under the stage it belongs to (the NetCDF
+  read under ``load``, the ``Point.within`` loop under ``mask``, the IDW loop
+  under ``interpolate``, ...; see :func:`watercourse.cells.cell_stage`), as
+  ``<stage>/cell <n>``;
+- the functions of this package that implement those stages, which are
+  wrapped with :func:`instrumented`.
+
+Figures saved with ``savefig`` are recorded as ``export``. A tutorial run
+directly with ``python script.py`` does not import this package and is not
+profiled. When profiling is on, every stage records
+
+- wall time,
+- bytes read by the process (``rchar`` and ``read_bytes`` from
+  ``/proc/self/io``, where available), and
+- peak resident set size at the end of the stage, and how much the peak grew
+  during it,
+
+and a JSON report, aggregated by stage, is written when the process exits.
+Two reports can be compared with ``python -m watercourse.instrument diff``.
+
+Profiling is switched on by ``WATERCOURSE_PROFILE``, set to the path of the
+report (``1`` writes ``watercourse-profile.json`` in the working directory).
+When it is off, :func:`stage` is a no-op.
+"""
+
+import argparse
+import atexit
+import contextlib
+import functools
+import json
+import os
+import resource
+import sys
+import time
+
+STAGES = ("load", "qc", "mask", "aggregate", "interpolate", "render", "export")
+
+
+def _io_counters():
+    """``{"rchar": ..., "read_bytes": ...}`` of this process, or ``{}``."""
+    try:
+        with open("/proc/self/io") as f:
+            fields = dict(line.split(":") for line in f)
+    except OSError:
+        return {}
+    return {key: int(fields[key]) for key in ("rchar", "read_bytes") if key in fields}
+
+
+def _peak_rss():
+    """Peak resident set size of this process, in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Profiler:
+    """Accumulates per-stage measurements and writes them as JSON."""
+
+    def __init__(self, path):
+        self.path = path
+        self.started = time.time()
+        self.stages = {}
+        self._stack = []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if name in self._stack:
+            # already inside this stage (e.g. savefig in an export cell)
+            yield
+            return
+        self._stack.append(name)
+        key = "/".join(self._stack)
+        io_start, peak_start = _io_counters(), _peak_rss()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            io_end, peak_end = _io_counters(), _peak_rss()
+            self._stack.pop()
+            record = self.stages.setdefault(key, {
+                "calls": 0, "wall_s": 0.0, "rchar": 0, "read_bytes": 0,
+                "peak_rss_bytes": 0, "peak_rss_growth_bytes": 0,
+            })
+            record["calls"] += 1
+            record["wall_s"] += wall
+            for counter in ("rchar", "read_bytes"):
+                record[counter] += io_end.get(counter, 0) - io_start.get(counter, 0)
+            record["peak_rss_bytes"] = max(record["peak_rss_bytes"], peak_end)
+            record["peak_rss_growth_bytes"] += peak_end - peak_start
+
+    def report(self):
+        return {
+            "version": 1,
+            "argv": sys.argv,
+            "started": self.started,
+            "total_wall_s": time.time() - self.started,
+            "peak_rss_bytes": _peak_rss(),
+            "stages": self.stages,
+        }
+
+    def write(self):
+        with open(self.path, "w") as f:
+            json.dump(self.report(), f, indent=1, sort_keys=True)
+
+
+_profiler = None
+
+
+def enable(path="watercourse-profile.json"):
+    """Start profiling this process; the report is written to ``path`` at exit."""
+    global _profiler
+    if _profiler is None:
+        _profiler = Profiler(path)
+        atexit.register(_profiler.write)
+        _patch_savefig()
+    return _profiler
+
+
+def stage(name):
+    """Context manager recording one stage (a no-op unless profiling is on)."""
+    if _profiler is None:
+        return contextlib.nullcontext()
+    return _profiler.stage(name)
+
+
+def instrumented(name):
+    """Decorator recording each call of a function as stage ``name``."""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return function(*args, **kwargs)
+            with _profiler.stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def _patch_savefig():
+    """Record ``Figure.savefig`` (and so ``plt.savefig``) as the ``export`` stage."""
+    try:
+        from matplotlib.figure import Figure
+    except ImportError:
+        return
+
+    if not getattr(Figure.savefig, "_instrumented", False):
+        Figure.savefig = instrumented("export")(Figure.savefig)
+        Figure.savefig._instrumented = True
+
+
+_setting = os.environ.get("WATERCOURSE_PROFILE")
+if _setting:
+    enable("watercourse-profile.json" if _setting == "1" else _setting)
+
+
+def diff(before, after):
+    """Lines comparing two reports stage by stage."""
+    stages = list(dict.fromkeys([*before["stages"], *after["stages"]]))
+    lines = [f"{'stage':<24} {'wall before':>12} {'wall after':>12} {'change':>8} "
+             f"{'read MiB':>10} {'peak RSS MiB':>13}"]
+    empty = {"wall_s": 0.0, "rchar": 0, "peak_rss_bytes": 0}
+    for name in stages:
+        a = before["stages"].get(name, empty)
+        b = after["stages"].get(name, empty)
+        change = f"{(b['wall_s'] / a['wall_s'] - 1) * 100:+7.1f}%" if a["wall_s"] else "     new"
+        lines.append(
+            f"{name:<24} {a['wall_s']:11.3f}s {b['wall_s']:11.3f}s {change:>8} "
+            f"{b['rchar'] / 2**20:10.1f} {b['peak_rss_bytes'] / 2**20:13.1f}"
+        )
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    compare = sub.add_parser("diff", help="compare two JSON reports")
+    compare.add_argument("before")
+    compare.add_argument("after")
+    args = parser.parse_args(argv)
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    print("\n".join(diff(before, after)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+"""Vectorised interpolation and gap-filling of gauge rainfall.
+
+``Ex1_Precipitation.py`` defines ``IDW()`` for a single target point and fills
+the precipitation map with a double loop over the grid. :func:`idw` computes
+the same weights for many targets at once, working through the targets in
+chunks so that the ``(targets, gauges)`` distance matrix stays small.
+
+:func:`fill_gaps` applies the station-average, normal-ratio and
+inverse-distance estimates of Ex1 (optionally restricted to the closest gauge
+per quadrant) to every missing or flagged value of a station x time record.
+Both take the validity of each gauge into account, e.g. the flags of
+:func:`watercourse.qc.screen`.
+
+Distances are planar by default, as in Ex1 (UTM coordinates). For gauge
+networks stored in longitude/latitude, ``metric="haversine"`` uses
+great-circle distances computed from unit vectors (see
+:func:`distance_matrix`).
+"""
+
+import numpy as np
+
+from .instrument import instrumented
+from .regrid import REARTH
+
+METHODS = ("mean", "normal-ratio", "idw")
+METRICS = ("euclidean", "haversine")
+
+
+def unit_vectors(lon, lat):
+    """Unit vectors ``(..., 3)`` of points on the sphere given in degrees."""
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+def _points(x, y, metric):
+    """Coordinates prepared for :func:`_pairwise`: ``(n, 2)`` planar or ``(n, 3)`` unit vectors."""
+    if metric == "euclidean":
+        return np.stack([np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)], axis=-1)
+    if metric == "haversine":
+        return unit_vectors(x, y)
+    raise ValueError(f"unknown metric {metric!r}; expected one of {METRICS}")
+
+
+def _pairwise(targets, stations, metric, radius):
+    """Distance matrix between prepared points."""
+    if metric == "euclidean":
+        return np.hypot(targets[:, None, 0] - stations[:, 0], targets[:, None, 1] - stations[:, 1])
+    # great-circle distance from the chord |u - v|, with |u - v|**2 = 2 - 2 u.v;
+    # squared chords within the rounding error of the dot product (well under
+    # a metre) are snapped to 0 so that coincident points are at distance 0
+    squared = np.clip(2.0 - 2.0 * (targets @ stations.T), 0.0, 4.0)
+    squared[squared < 1e-15] = 0.0
+    return 2.0 * radius * np.arcsin(np.sqrt(squared) / 2.0)
+
+
+def distance_matrix(x, y, stn_x, stn_y, metric="euclidean", radius=REARTH):
+    """Distances between the targets ``(x, y)`` (1-D) and the gauges, shape ``(targets, gauges)``.
+
+    With ``metric="euclidean"`` the coordinates are planar (the UTM metres of
+    ``RainfallData_Exercise_001.csv``). With ``metric="haversine"``, ``x`` is
+    longitude and ``y`` latitude in degrees and the great-circle distance on a
+    sphere of ``radius`` (metres) is returned; every point is converted to a
+    unit vector once, so the distances come from one matrix product.
+    """
+    return _pairwise(_points(x, y, metric), _points(stn_x, stn_y, metric), metric, radius)
+
+
+@instrumented("interpolate")
+def idw(x, y, stn_x, stn_y, stn_p, b=-2, chunk_size=2**16, valid=None, metric="euclidean", radius=REARTH):
+    """Inverse-distance-weighted estimate at the points ``(x, y)``.
+
+    Same weights as ``IDW()`` in ``Ex1_Precipitation.py``
+    (``w_i = d_i**b / sum(d**b)``), without rounding the result. A target that
+    coincides with a gauge takes that gauge's value (``IDW()`` returns NaN).
+
+    Args:
+      x, y: coordinates of the targets (any matching shapes).
+      stn_x, stn_y: coordinates of the gauges.
+      stn_p: observed precipitation at the gauges.
+      b: exponent of the inverse distance (default -2).
+      chunk_size: number of targets processed at a time.
+      valid: boolean array, one per gauge; gauges where it is ``False``
+        (e.g. flagged by :func:`watercourse.qc.screen`) are left out.
+      metric: ``"euclidean"``, or ``"haversine"`` for longitude/latitude in
+        degrees (see :func:`distance_matrix`).
+      radius: radius of the sphere of ``"haversine"``, in metres.
+
+    Returns:
+      Array with the shape of ``x``.
+    """
+    x, y = np.broadcast_arrays(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+    stn_x = np.asarray(stn_x, dtype=np.float64)
+    stn_y = np.asarray(stn_y, dtype=np.float64)
+    stn_p = np.asarray(stn_p, dtype=np.float64)
+    if valid is not None:
+        valid = np.asarray(valid, dtype=bool)
+        stn_x, stn_y, stn_p = stn_x[valid], stn_y[valid], stn_p[valid]
+    stations = _points(stn_x, stn_y, metric)
+    tx, ty = x.ravel(), y.ravel()
+    out = np.empty(tx.shape)
+    for start in range(0, len(tx), chunk_size):
+        stop = min(start + chunk_size, len(tx))
+        dist = _pairwise(_points(tx[start:stop], ty[start:stop], metric), stations, metric, radius)
+        # a target on a gauge gets infinite weights (inf / inf = NaN); its
+        # value is set from the gauge below
+        with np.errstate(divide="ignore", invalid="ignore"):
+            weights = dist ** b
+            p = weights @ stn_p / weights.sum(axis=1)
+        hit_row, hit_gauge = np.nonzero(dist == 0)
+        p[hit_row] = stn_p[hit_gauge]
+        out[start:stop] = p
+    return out.reshape(x.shape)
+
+
+def idw_grid(X, Y, stn_x, stn_y, stn_p, b=-2, valid=None, metric="euclidean", radius=REARTH):
+    """IDW map over the grid ``X`` x ``Y``, laid out as ``pcp`` in ``Ex1_Precipitation.py``.
+
+    Row 0 is the largest ``Y`` (the map is ready for ``plt.imshow`` with
+    ``extent=[xo, xf, yo, yf]``) and columns follow ``X``.
+    """
+    grid_x, grid_y = np.meshgrid(X, np.asarray(Y)[::-1])
+    return idw(grid_x, grid_y, stn_x, stn_y, stn_p, b, valid=valid, metric=metric, radius=radius)
+
+
+def quadrant_neighbours(x, y, stn_x, stn_y, metric="euclidean", radius=REARTH):
+    """Closest gauge to each target in the NW, NE, SW and SE quadrants.
+
+    Gauges at the target itself are skipped. East and north include the axes
+    (``dx >= 0``, ``dy >= 0``). With ``metric="haversine"``, east and north
+    are the local directions at each target, and distances are great-circle.
+
+    Returns:
+      Integer array of shape ``(targets, 4)``; -1 where a quadrant is empty.
+    """
+    targets, stations = _points(x, y, metric), _points(stn_x, stn_y, metric)
+    dist = _pairwise(targets, stations, metric, radius)
+    if metric == "euclidean":
+        dx = stations[:, 0] - targets[:, None, 0]
+        dy = stations[:, 1] - targets[:, None, 1]
+    else:
+        # components of the gauges' unit vectors along the local east and
+        # north vectors of each target (the target's own component is zero)
+        lon = np.radians(np.asarray(x, dtype=np.float64))
+        lat = np.radians(np.asarray(y, dtype=np.float64))
+        east = np.stack([-np.sin(lon), np.cos(lon), np.zeros_like(lon)], axis=-1)
+        north = np.stack([-np.sin(lat) * np.cos(lon), -np.sin(lat) * np.sin(lon), np.cos(lat)], axis=-1)
+        dx, dy = east @ stations.T, north @ stations.T
+    quadrant = 2 * (dy < 0) + (dx >= 0)
+    out = np.full((len(dist), 4), -1)
+    for q in range(4):
+        masked = np.where((quadrant == q) & (dist > 0), dist, np.inf)
+        nearest = masked.argmin(axis=1)
+        found = np.isfinite(masked[np.arange(len(dist)), nearest])
+        out[found, q] = nearest[found]
+    return out
+
+
+def station_weights(stn_x, stn_y, method="idw", b=-2, normals=None, quadrants=False,
+                    metric="euclidean", radius=REARTH):
+    """Weights of every other gauge in the estimate at each gauge.
+
+    Args:
+      stn_x, stn_y: coordinates of the gauges.
+      method: ``"mean"`` (station average), ``"normal-ratio"`` or ``"idw"``.
+      b: exponent of the inverse distance.
+      normals: long-term average annual precipitation of each gauge (``Pan``
+        in Ex1); needed by ``"normal-ratio"``.
+      quadrants: only use the closest gauge in each quadrant.
+      metric, radius: distance between gauges (see :func:`distance_matrix`).
+
+    Returns:
+      ``(weights, counts)`` matrices of shape ``(gauges, gauges)`` with a zero
+      diagonal. The estimate at gauge ``o`` is
+      ``sum_i weights[o, i] p_i / sum_i counts[o, i]`` over the valid gauges
+      ``i``: normal-ratio weights ``Pan_o / Pan_i`` are averaged over the
+      number of gauges, IDW weights are normalised by their sum.
+    """
+    if method not in METHODS:
+        raise ValueError(f"unknown method {method!r}; expected one of {METHODS}")
+    stn_x = np.asarray(stn_x, dtype=np.float64)
+    stn_y = np.asarray(stn_y, dtype=np.float64)
+    n = len(stn_x)
+    if quadrants:
+        use = np.zeros((n, n), dtype=bool)
+        neighbours = quadrant_neighbours(stn_x, stn_y, stn_x, stn_y, metric, radius)
+        rows, cols = np.nonzero(neighbours >= 0)
+        use[rows, neighbours[rows, cols]] = True
+    else:
+        use = ~np.eye(n, dtype=bool)
+    counts = use.astype(np.float64)
+    if method == "mean":
+        return counts, counts
+    if method == "normal-ratio":
+        if normals is None:
+            raise ValueError("the normal-ratio method needs the gauges' normals")
+        normals = np.asarray(normals, dtype=np.float64)
+        return counts * normals[:, None] / normals[None, :], counts
+    with np.errstate(divide="ignore"):
+        weights = np.where(use, distance_matrix(stn_x, stn_y, stn_x, stn_y, metric, radius) ** b, 0.0)
+    return weights, weights
+
+
+def fill_gaps(values, stn_x, stn_y, flags=None, method="idw", b=-2, normals=None, quadrants=False,
+              metric="euclidean", radius=REARTH):
+    """Replace missing and flagged values of a station x time record by estimates.
+
+    At each time step, every gauge whose value is NaN or flagged is estimated
+    from the valid gauges at that step with :func:`station_weights`; all
+    steps are done together as two matrix products.
+
+    Args:
+      values: rainfall of shape ``(gauges, times)`` (or ``(gauges,)``).
+      stn_x, stn_y: coordinates of the gauges.
+      flags: QC flags with the shape of ``values``; non-zero values are
+        treated as missing.
+      method, b, normals, quadrants, metric, radius: see
+        :func:`station_weights`.
+
+    Returns:
+      A filled copy of ``values``; NaN where no valid neighbour exists.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    valid = np.isfinite(values)
+    if flags is not None:
+        valid &= np.asarray(flags) == 0
+    weights, counts = station_weights(stn_x, stn_y, method, b, normals, quadrants, metric, radius)
+    numerator = weights @ np.where(valid, values, 0.0)
+    denominator = counts @ valid.astype(np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        estimate = np.where(denominator > 0, numerator / denominator, np.nan)
+    return np.where(valid, values, estimate)
@@ -0,0 +1,165 @@
+"""Quality-control screening of gauge records before interpolation.
+
+``Ex1_Precipitation.py`` uses every value of the ``p`` column as it is, so a
+single bad gauge distorts the IDW map and all the ``po_*`` estimates.
+:func:`screen` checks a whole station x time record and returns one flag byte
+per value, made of the bits
+
+``NEGATIVE``
+  the value is below zero.
+``SPIKE``
+  the value is far above the rest of its station's values in a centred
+  rolling window (``spike_z`` standard deviations, and at least
+  ``spike_min`` mm) and not matched at the neighbouring gauges (more than
+  ``spike_ratio`` times their estimate).
+``STUCK``
+  the same non-zero value repeats for ``stuck_length`` or more consecutive
+  steps (zero runs are ordinary dry spells).
+``SPATIAL``
+  the value is far from its leave-one-out IDW estimate from the other gauges
+  at that step (by more than ``spatial_abs`` mm and ``spatial_rel`` times the
+  estimate).
+
+The window statistics come from cumulative sums and the runs from one pass
+over the record, so the time-series checks are linear in its length; the
+neighbour estimates are ``(gauges, gauges) @ (gauges, times)`` products.
+Values flagged by the first three checks are not used as neighbours in the
+spatial check. Flags are honoured by :func:`watercourse.interpolate.fill_gaps`
+(``flags=``) and :func:`watercourse.interpolate.idw` (``valid=flags == 0``).
+The thresholds are heuristics for daily totals; tune them to the network.
+"""
+
+import numpy as np
+
+from .instrument import instrumented
+from .interpolate import station_weights
+
+NEGATIVE = 1
+SPIKE = 2
+STUCK = 4
+SPATIAL = 8
+
+FLAGS = {"negative": NEGATIVE, "spike": SPIKE, "stuck": STUCK, "spatial": SPATIAL}
+
+
+def _window_sums(values, half):
+    """Sums of ``values`` over the centred windows ``[t - half, t + half]`` along the last axis."""
+    ntime = values.shape[-1]
+    totals = np.zeros(values.shape[:-1] + (ntime + 1,))
+    np.cumsum(values, axis=-1, out=totals[..., 1:])
+    t = np.arange(ntime)
+    return totals[..., np.minimum(t + half + 1, ntime)] - totals[..., np.maximum(t - half, 0)]
+
+
+def spikes(values, window=31, spike_z=5.0, spike_min=25.0, estimate=None, spike_ratio=3.0):
+    """``True`` where a value is a spike against its station's rolling window.
+
+    The mean and standard deviation of each window leave out the value being
+    tested, so a spike does not inflate its own threshold. Heavy rain shows up
+    at the neighbouring gauges too; when the neighbours' ``estimate`` is
+    given, only values above ``spike_ratio`` times it are spikes.
+    """
+    finite = np.isfinite(values)
+    v = np.where(finite, values, 0.0)
+    half = window // 2
+    count = _window_sums(finite.astype(np.float64), half) - finite
+    total = _window_sums(v, half) - v
+    squares = _window_sums(v * v, half) - v * v
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / count
+        std = np.sqrt(np.maximum(squares / count - mean * mean, 0.0))
+        found = finite & (count >= half) & (v >= spike_min) & (v - mean > spike_z * std)
+        if estimate is not None:
+            found &= ~(v <= spike_ratio * estimate)
+    return found
+
+
+def stuck(values, stuck_length=5):
+    """``True`` on runs of at least ``stuck_length`` equal, non-zero values along time."""
+    starts = np.ones(values.shape, dtype=bool)
+    # NaN != NaN, so missing values always start a new run
+    starts[:, 1:] = values[:, 1:] != values[:, :-1]
+    run = np.cumsum(starts.ravel()) - 1
+    lengths = np.bincount(run)
+    return (lengths[run].reshape(values.shape) >= stuck_length) & (values != 0) & np.isfinite(values)
+
+
+def neighbour_estimate(values, stn_x, stn_y, valid=None, b=-2, metric="euclidean"):
+    """Leave-one-out IDW estimate of every value from the other gauges at the same step.
+
+    Args:
+      values: rainfall of shape ``(gauges, times)``.
+      stn_x, stn_y: coordinates of the gauges.
+      valid: values that may be used as neighbours (default: finite ones).
+      b: exponent of the inverse distance.
+      metric: ``"euclidean"``, or ``"haversine"`` for gauges in
+        longitude/latitude (see :func:`watercourse.interpolate.distance_matrix`).
+
+    Returns:
+      ``(estimate, neighbours)``: the estimates (NaN without neighbours) and
+      the number of valid neighbours of each value.
+    """
+    finite = np.isfinite(values)
+    valid = finite if valid is None else valid & finite
+    weights, _ = station_weights(stn_x, stn_y, "idw", b, metric=metric)
+    used = valid.astype(np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        estimate = (weights @ np.where(valid, values, 0.0)) / (weights @ used)
+    return estimate, (weights > 0).astype(np.float64) @ used
+
+
+def spatial_outliers(values, estimate, neighbours, spatial_abs=20.0, spatial_rel=1.0, min_neighbours=3):
+    """``True`` where a value is far from its :func:`neighbour_estimate`.
+
+    A value is an outlier when ``|value - estimate| > max(spatial_abs,
+    spatial_rel * estimate)`` and it has at least ``min_neighbours`` valid
+    neighbours.
+    """
+    with np.errstate(invalid="ignore"):
+        far = np.abs(values - estimate) > np.maximum(spatial_abs, spatial_rel * estimate)
+    return np.isfinite(values) & (neighbours >= min_neighbours) & far
+
+
+@instrumented("qc")
+def screen(values, stn_x, stn_y, window=31, spike_z=5.0, spike_min=25.0, spike_ratio=3.0,
+           stuck_length=5, b=-2, spatial_abs=20.0, spatial_rel=1.0, min_neighbours=3,
+           metric="euclidean"):
+    """QC flags of a station x time rainfall record.
+
+    Args:
+      values: rainfall of shape ``(gauges, times)``, or ``(gauges,)`` for a
+        single step (only the negative and spatial checks apply); NaN marks
+        missing values, which are never flagged.
+      stn_x, stn_y: coordinates of the gauges.
+      window: length of the rolling window of the spike check, in steps.
+      spike_z, spike_min, spike_ratio: thresholds of :func:`spikes`.
+      stuck_length: shortest flagged run of :func:`stuck`.
+      b: exponent of the inverse distance of the neighbour estimates.
+      spatial_abs, spatial_rel, min_neighbours: see :func:`spatial_outliers`.
+      metric: distance between gauges, see :func:`neighbour_estimate`.
+
+    Returns:
+      ``uint8`` array with the shape of ``values``; a combination of
+      :data:`NEGATIVE`, :data:`SPIKE`, :data:`STUCK` and :data:`SPATIAL`,
+      0 for values that passed.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    single = values.ndim == 1
+    if single:
+        values = values[:, None]
+    flags = np.zeros(values.shape, dtype=np.uint8)
+    with np.errstate(invalid="ignore"):
+        flags[values < 0] |= NEGATIVE
+    if not single:
+        estimate, _ = neighbour_estimate(values, stn_x, stn_y, flags == 0, b, metric)
+        flags[spikes(values, window, spike_z, spike_min, estimate, spike_ratio)] |= SPIKE
+        flags[stuck(values, stuck_length)] |= STUCK
+    estimate, neighbours = neighbour_estimate(values, stn_x, stn_y, flags == 0, b, metric)
+    flags[spatial_outliers(values, estimate, neighbours, spatial_abs, spatial_rel, min_neighbours)] |= SPATIAL
+    return flags[:, 0] if single else flags
+
+
+def summary(flags):
+    """Number of values carrying each flag, e.g. ``{"negative": 0, "spike": 3, ...}``."""
+    flags = np.asarray(flags)
+    return {name: int(np.count_nonzero(flags & bit)) for name, bit in FLAGS.items()}
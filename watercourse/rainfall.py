@@ -0,0 +1,265 @@
+"""Compact loading and basin aggregation of gridded daily rainfall.
+
+``basics_01.py`` reads ``rain_day`` with ``data["rain_day"][:]``, which gives a
+float64 ``numpy.ma.MaskedArray`` (8 bytes per value plus a 1 byte mask).  The
+loaders here keep the same data in a smaller form:
+
+- ``mode="float32"``: a plain float32 array with NaN where the file has fill
+  values (4 bytes per value).
+- ``mode="packed"``: the raw integers stored in the file together with their
+  ``scale_factor``/``add_offset``, decoded to float32 only for the slice that is
+  requested (2 bytes per value for the usual int16 packing).
+
+The mask, aggregation and trend helpers accept any of these forms, as well as
+the original masked array, and work through the time axis in chunks so that
+only one chunk is ever decoded to floating point at a time.
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+
+from .instrument import instrumented
+
+
+@dataclass
+class RainfallGrid:
+    """Rainfall cube with its coordinates.
+
+    Attributes:
+      rain: ``(time, lat, lon)`` values. An ndarray, a masked array or a
+        :class:`PackedArray`, depending on the loading mode.
+      lats: latitude of the grid cell centres.
+      lons: longitude of the grid cell centres.
+      time: raw time values as stored in the file.
+      time_units: CF units string of ``time`` (e.g. ``"days since 1900-01-01"``).
+      calendar: CF calendar of ``time``.
+    """
+
+    rain: object
+    lats: np.ndarray
+    lons: np.ndarray
+    time: np.ndarray
+    time_units: str = "days since 1900-01-01"
+    calendar: str = "standard"
+
+    @property
+    def years(self):
+        """Time as fractional years, as computed in ``basics_01.py``."""
+        return self.time / 365.25 + 1900
+
+
+class PackedArray:
+    """Packed integer values decoded lazily to float32.
+
+    Indexing returns a decoded float32 ndarray for the requested slice only,
+    with NaN in place of ``fill_value``. The full array is never held in
+    floating point unless it is explicitly converted with ``np.asarray``.
+    """
+
+    def __init__(self, raw, scale_factor=1.0, add_offset=0.0, fill_value=None):
+        self.raw = raw
+        self.scale_factor = scale_factor
+        self.add_offset = add_offset
+        self.fill_value = fill_value
+
+    @property
+    def shape(self):
+        return self.raw.shape
+
+    @property
+    def ndim(self):
+        return self.raw.ndim
+
+    @property
+    def dtype(self):
+        return np.dtype(np.float32)
+
+    @property
+    def nbytes(self):
+        return self.raw.nbytes
+
+    def __len__(self):
+        return len(self.raw)
+
+    def __getitem__(self, key):
+        return self.decode(self.raw[key])
+
+    def __array__(self, dtype=None, copy=None):
+        values = self.decode(self.raw)
+        return values if dtype is None else values.astype(dtype)
+
+    def decode(self, values):
+        """Decode a block of packed values to float32 with NaN fill."""
+        values = np.asarray(values)
+        out = values.astype(np.float32)
+        if self.scale_factor != 1:
+            out *= np.float32(self.scale_factor)
+        if self.add_offset != 0:
+            out += np.float32(self.add_offset)
+        if self.fill_value is not None:
+            out[values == self.fill_value] = np.nan
+        return out
+
+
+def _fill_value(var):
+    """Fill value of a netCDF4 variable, falling back to the netCDF default."""
+    import netCDF4 as nc
+
+    for attr in ("_FillValue", "missing_value"):
+        if attr in var.ncattrs():
+            return np.asarray(var.getncattr(attr)).ravel()[0]
+    return nc.default_fillvals.get(var.dtype.str[1:])
+
+
+@instrumented("load")
+def load_rain_day(filename, variable="rain_day", mode="float32", chunk_size=366):
+    """Load a daily rainfall NetCDF file.
+
+    Args:
+      filename: path of the NetCDF file (e.g. ``rain_day_2025.nc``).
+      variable: name of the rainfall variable.
+      mode: ``"masked"`` for the float64 masked array that ``basics_01.py``
+        uses, ``"float32"`` for a float32 array with NaN fill, or ``"packed"``
+        for a :class:`PackedArray` over the raw stored integers.
+      chunk_size: number of time steps decoded at a time in ``"float32"`` mode,
+        which bounds the temporary memory used while loading.
+
+    Returns:
+      A :class:`RainfallGrid`.
+    """
+    import netCDF4 as nc
+
+    if mode not in ("masked", "float32", "packed"):
+        raise ValueError(f"Unknown loading mode: {mode!r}")
+
+    with nc.Dataset(filename) as data:
+        lats = data["latitude"][:].filled(np.nan)
+        lons = data["longitude"][:].filled(np.nan)
+        time_var = data["time"]
+        time = np.asarray(time_var[:], dtype=np.float64)
+        time_units = getattr(time_var, "units", "days since 1900-01-01")
+        calendar = getattr(time_var, "calendar", "standard")
+
+        var = data[variable]
+        if mode == "masked":
+            rain = var[:]
+        else:
+            var.set_auto_maskandscale(False)
+            packed = PackedArray(
+                None,
+                scale_factor=getattr(var, "scale_factor", 1.0),
+                add_offset=getattr(var, "add_offset", 0.0),
+                fill_value=_fill_value(var),
+            )
+            if mode == "packed":
+                packed.raw = var[:]
+                rain = packed
+            else:
+                rain = np.empty(var.shape, dtype=np.float32)
+                for start in range(0, var.shape[0], chunk_size):
+                    stop = min(start + chunk_size, var.shape[0])
+                    rain[start:stop] = packed.decode(var[start:stop])
+
+    return RainfallGrid(rain, lats, lons, time, time_units, calendar)
+
+
+def read_block(rain, start, stop, rows=None):
+    """Return ``rain[start:stop, rows]`` as a float32 ndarray with NaN for missing values.
+
+    ``rain`` may be an ndarray, a masked array, a :class:`PackedArray` or a
+    netCDF4 variable.
+    """
+    block = rain[start:stop] if rows is None else rain[start:stop, rows]
+    if np.ma.isMaskedArray(block):
+        return block.astype(np.float32).filled(np.nan)
+    return np.asarray(block, dtype=np.float32)
+
+
+@instrumented("mask")
+def basin_mask(geometry, lats, lons):
+    """Boolean mask of the grid cells whose centre lies inside ``geometry``.
+
+    Vectorised equivalent of the ``Point.within`` double loop in
+    ``basics_01.py``; points on the boundary are outside, as with ``within``.
+    """
+    import shapely
+
+    lons_x, lats_x = np.meshgrid(lons, lats)
+    return shapely.contains_xy(geometry, lons_x, lats_x)
+
+
+@instrumented("aggregate")
+def basin_mean(rain, mask, chunk_size=366):
+    """Basin-averaged rainfall at each time step.
+
+    Matches ``np.sum(MDB_mask * rain_day[i]) / np.sum(MDB_mask)`` from
+    ``basics_01.py``: missing values contribute zero and the sum is divided by
+    the number of cells in the mask.
+
+    Args:
+      rain: ``(time, lat, lon)`` rainfall in any of the loaded forms.
+      mask: ``(lat, lon)`` boolean (or 0/1) basin mask.
+      chunk_size: number of time steps processed at a time.
+
+    Returns:
+      float64 array of length ``time``.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    ncells = np.count_nonzero(mask)
+    total = np.zeros(rain.shape[0])
+    for start in range(0, rain.shape[0], chunk_size):
+        stop = min(start + chunk_size, rain.shape[0])
+        values = read_block(rain, start, stop)[:, mask]
+        total[start:stop] = np.nansum(values, axis=1, dtype=np.float64)
+    return total / ncells
+
+
+def linear_trend(t, y):
+    """Least-squares slope and intercept of ``y`` against ``t``, ignoring NaNs."""
+    t = np.asarray(t, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    valid = np.isfinite(t) & np.isfinite(y)
+    slope, intercept = np.polyfit(t[valid], y[valid], 1)
+    return slope, intercept
+
+
+@instrumented("aggregate")
+def trend_map(rain, t, chunk_size=366):
+    """Per-cell least-squares trend of rainfall against ``t``.
+
+    The regression sums are accumulated chunk by chunk, so the cube is never
+    converted to float64 as a whole. Cells with fewer than two valid values
+    are NaN.
+
+    Args:
+      rain: ``(time, lat, lon)`` rainfall in any of the loaded forms.
+      t: time coordinate of length ``time`` (e.g. :attr:`RainfallGrid.years`).
+      chunk_size: number of time steps processed at a time.
+
+    Returns:
+      ``(lat, lon)`` array of slopes, in rainfall units per unit of ``t``.
+    """
+    t = np.asarray(t, dtype=np.float64)
+    t = t - t.mean()  # centring keeps the sums well conditioned
+    shape = rain.shape[1:]
+    n = np.zeros(shape)
+    st = np.zeros(shape)
+    sy = np.zeros(shape)
+    stt = np.zeros(shape)
+    sty = np.zeros(shape)
+    for start in range(0, rain.shape[0], chunk_size):
+        stop = min(start + chunk_size, rain.shape[0])
+        y = read_block(rain, start, stop)
+        valid = np.isfinite(y)
+        y = np.where(valid, y, 0).astype(np.float64)
+        tb = t[start:stop, None, None] * valid
+        n += valid.sum(axis=0)
+        st += tb.sum(axis=0)
+        sy += y.sum(axis=0)
+        stt += (tb * tb).sum(axis=0)
+        sty += (tb * y).sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slope = (n * sty - st * sy) / (n * stt - st * st)
+    slope[n < 2] = np.nan
+    return slope
@@ -0,0 +1,190 @@
+"""Conservative (area-weighted) regridding between regular lat/lon grids.
+
+Used to put the 0.05 degree AGCD ``rain_day`` grid from ``basics_01.py`` and
+the 0.25 degree GRACE mascon grid from ``basics_02.py`` on a common grid.
+
+Each destination value is the area-weighted mean of the source cells that
+overlap it, with overlap areas computed on the sphere with the exact formula
+of ``basics_02.py``:
+
+    A = R^2 |sin(phi_2) - sin(phi_1)| |lambda_2 - lambda_1|
+
+Because both grids are regular in latitude and longitude, the overlap matrix
+is the Kronecker product of a latitude overlap matrix (in ``sin(phi)``) and a
+longitude overlap matrix (in radians). It is built once per grid pair as a
+sparse matrix, cached on disk, and applied to the data one chunk of time steps
+at a time as a sparse matrix-matrix product.
+"""
+
+import hashlib
+
+import numpy as np
+
+from .cache import atomic_write, cache_dir
+from .instrument import instrumented
+
+REARTH = 6370e3  # Radius of the Earth in meters, as in basics_02.py
+
+
+def cell_edges(centres):
+    """Edges of the cells around 1-D cell centres (half way between centres)."""
+    centres = np.asarray(centres, dtype=np.float64)
+    mid = 0.5 * (centres[1:] + centres[:-1])
+    first = centres[0] - (mid[0] - centres[0])
+    last = centres[-1] + (centres[-1] - mid[-1])
+    return np.concatenate([[first], mid, [last]])
+
+
+def _lat_edges(lats):
+    return np.clip(cell_edges(lats), -90, 90)
+
+
+def cell_areas(lats, lons, radius=REARTH):
+    """Area (m^2) of each ``(lat, lon)`` grid cell using the exact spherical formula."""
+    sin_edges = np.sin(np.radians(_lat_edges(lats)))
+    lon_edges = np.radians(cell_edges(lons))
+    return radius ** 2 * np.outer(np.abs(np.diff(sin_edges)), np.abs(np.diff(lon_edges)))
+
+
+def _overlaps(src_lo, src_hi, dst_lo, dst_hi):
+    """Overlapping (dst, src) interval pairs and their overlap length.
+
+    Destination intervals must not overlap each other, so that sorting them
+    by lower edge also sorts their upper edges.
+    """
+    order = np.argsort(dst_lo)
+    lo_s, hi_s = dst_lo[order], dst_hi[order]
+    first = np.searchsorted(hi_s, src_lo, side="right")
+    last = np.searchsorted(lo_s, src_hi, side="left")
+    counts = np.maximum(last - first, 0)
+    src = np.repeat(np.arange(len(src_lo)), counts)
+    offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    dst = np.repeat(first, counts) + offset
+    overlap = np.minimum(src_hi[src], hi_s[dst]) - np.maximum(src_lo[src], lo_s[dst])
+    keep = overlap > 0
+    return order[dst[keep]], src[keep], overlap[keep]
+
+
+def _bounds(edges):
+    return np.minimum(edges[:-1], edges[1:]), np.maximum(edges[:-1], edges[1:])
+
+
+def _overlap_matrix(src_edges, dst_edges, periodic=False):
+    from scipy import sparse
+
+    src_lo, src_hi = _bounds(src_edges)
+    dst_lo, dst_hi = _bounds(dst_edges)
+    shifts = (-360.0, 0.0, 360.0) if periodic else (0.0,)
+    rows, cols, vals = [], [], []
+    for shift in shifts:
+        dst, src, overlap = _overlaps(src_lo + shift, src_hi + shift, dst_lo, dst_hi)
+        rows.append(dst)
+        cols.append(src)
+        vals.append(overlap)
+    shape = (len(dst_lo), len(src_lo))
+    return sparse.csr_matrix(
+        (np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))), shape=shape
+    )
+
+
+def overlap_weights(src_lats, src_lons, dst_lats, dst_lons, radius=REARTH):
+    """Sparse ``(n_dst, n_src)`` matrix of overlap areas (m^2) between two grids.
+
+    Cells are numbered in row-major ``(lat, lon)`` order, matching
+    ``cube.reshape(ntime, -1)``. Longitudes are treated as periodic, so a
+    -180..180 grid can be regridded onto a 0..360 grid.
+    """
+    from scipy import sparse
+
+    w_lat = _overlap_matrix(
+        np.sin(np.radians(_lat_edges(src_lats))), np.sin(np.radians(_lat_edges(dst_lats)))
+    )
+    w_lon = _overlap_matrix(cell_edges(src_lons), cell_edges(dst_lons), periodic=True)
+    w_lon = w_lon * np.radians(1.0)
+    return (radius ** 2 * sparse.kron(w_lat, w_lon)).tocsr()
+
+
+class Regridder:
+    """Conservative regridder between a fixed pair of lat/lon grids.
+
+    The overlap matrix is computed on first use and stored in the shared
+    cache (see :func:`watercourse.cache.cache_dir`), keyed on a hash of the
+    four coordinate arrays; later instances for the same pair of grids load
+    it from disk.
+
+    Example::
+
+        regridder = Regridder(lats, lons, ds["lat"].values, ds["lon"].values)
+        rain_025 = regridder.regrid(rain_day)
+    """
+
+    def __init__(self, src_lats, src_lons, dst_lats, dst_lons, radius=REARTH, directory=None):
+        self.src_shape = (len(src_lats), len(src_lons))
+        self.dst_shape = (len(dst_lats), len(dst_lons))
+        coords = (src_lats, src_lons, dst_lats, dst_lons)
+        self.key = self._hash(coords, radius)
+        self.path = (directory or cache_dir("regrid")) / f"conservative-{self.key}.npz"
+        self._coords = coords
+        self._radius = radius
+        self._weights = None
+
+    @staticmethod
+    def _hash(coords, radius):
+        digest = hashlib.sha256(f"conservative-v1 {radius!r}".encode())
+        for values in coords:
+            values = np.ascontiguousarray(values, dtype=np.float64)
+            digest.update(str(values.shape).encode())
+            digest.update(values.tobytes())
+        return digest.hexdigest()[:32]
+
+    @property
+    def weights(self):
+        """Sparse ``(n_dst, n_src)`` overlap-area matrix."""
+        if self._weights is None:
+            from scipy import sparse
+
+            if self.path.exists():
+                self._weights = sparse.load_npz(self.path)
+            else:
+                self._weights = overlap_weights(*self._coords, radius=self._radius)
+                atomic_write(self.path, lambda f: sparse.save_npz(f, self._weights))
+        return self._weights
+
+    @instrumented("aggregate")
+    def regrid(self, cube, chunk_size=64, out=None):
+        """Regrid a ``(time, lat, lon)`` cube, ``chunk_size`` time steps at a time.
+
+        Missing (NaN or masked) source values are left out and the remaining
+        overlaps renormalised; destination cells with no valid overlap are NaN.
+
+        Args:
+          cube: source values; any array-like that supports slicing along
+            time, including netCDF4 variables and
+            :class:`watercourse.rainfall.PackedArray`. A 2-D field is
+            regridded as a single time step.
+          chunk_size: number of time steps held in memory at once.
+          out: optional array-like of shape ``(time,) + dst_shape`` to write
+            into (e.g. a netCDF4 variable). A new float32 array by default.
+
+        Returns:
+          The regridded cube (``out`` if given).
+        """
+        from .rainfall import read_block
+
+        if np.ndim(cube) == 2:
+            # read_block keeps missing values (a masked array's mask) as NaN
+            return self.regrid(read_block(cube, 0, cube.shape[0])[None], chunk_size)[0]
+        weights = self.weights
+        ntime = cube.shape[0]
+        if out is None:
+            out = np.empty((ntime,) + self.dst_shape, dtype=np.float32)
+        for start in range(0, ntime, chunk_size):
+            stop = min(start + chunk_size, ntime)
+            block = read_block(cube, start, stop).reshape(stop - start, -1).T
+            valid = np.isfinite(block)
+            total = weights @ np.where(valid, block, 0).astype(np.float64)
+            area = weights @ valid.astype(np.float64)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                values = np.where(area > 0, total / area, np.nan)
+            out[start:stop] = values.T.reshape((stop - start,) + self.dst_shape)
+        return out
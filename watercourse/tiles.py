@@ -0,0 +1,183 @@
+"""Tiled multi-resolution image pyramid of an interpolated surface.
+
+``Ex1_Precipitation.py`` saves the whole interpolated map (``pcp``) as one
+PNG. For panning and zooming over large surfaces, :func:`write_tiles` writes
+the grid as ``<directory>/<z>/<x>/<y>.png`` tiles instead:
+
+- the finest level ``z = levels - 1`` holds the grid at full resolution, one
+  grid cell per pixel; level 0 fits in a single tile. Tiles are addressed in
+  the grid's own coordinates (row 0 at the top, as in ``pcp``), which web
+  viewers display with a simple, non-geographic CRS (e.g. Leaflet's
+  ``L.CRS.Simple``); the map extent is recorded in the metadata.
+- each coarser level is the mean of 2 x 2 cells of the level below (NaN cells
+  are ignored), so the surface is interpolated only once.
+- tiles are coloured with a fixed colour map and range, so that a tile's image
+  depends only on its own data, and are encoded in parallel threads.
+- ``tiles.json`` records a hash of every tile's data and rendering options;
+  tiles whose hash has not changed are not rewritten, and tiles that no longer
+  exist are deleted.
+
+Example::
+
+    pcp = idw_grid(X, Y, data1_.X, data1_.Y, data1_.p)
+    write_tiles(pcp, "Ex1_tiles", extent=[xo, xf, yo, yf], vmin=0, vmax=40)
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import math
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from .cache import atomic_write
+from .instrument import instrumented
+
+MANIFEST = "tiles.json"
+
+
+def level_count(shape, tile_size=256):
+    """Number of levels needed for level 0 to fit in one tile."""
+    return 1 + max(0, math.ceil(math.log2(max(shape) / tile_size)))
+
+
+def downsample(grid):
+    """Mean of each 2 x 2 block of ``grid``, ignoring NaN; odd edges are padded with NaN."""
+    ny, nx = grid.shape
+    padded = np.full((ny + ny % 2, nx + nx % 2), np.nan, dtype=np.float32)
+    padded[:ny, :nx] = grid
+    blocks = padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2)
+    valid = ~np.isnan(blocks)
+    total = np.where(valid, blocks, 0).sum(axis=(1, 3))
+    count = valid.sum(axis=(1, 3))
+    with np.errstate(invalid="ignore"):
+        return np.where(count > 0, total / count, np.nan).astype(np.float32)
+
+
+def pyramid(grid, tile_size=256):
+    """Levels of the pyramid, coarsest (level 0) first."""
+    levels = [np.asarray(grid, dtype=np.float32)]
+    for _ in range(level_count(levels[0].shape, tile_size) - 1):
+        levels.append(downsample(levels[-1]))
+    return levels[::-1]
+
+
+def _tiles(level, tile_size):
+    """``(x, y, data)`` of the tiles of one level; edge tiles are padded with NaN."""
+    ny, nx = level.shape
+    for y in range(math.ceil(ny / tile_size)):
+        for x in range(math.ceil(nx / tile_size)):
+            data = level[y * tile_size:(y + 1) * tile_size, x * tile_size:(x + 1) * tile_size]
+            if data.shape != (tile_size, tile_size):
+                data = np.pad(data, [(0, tile_size - data.shape[0]), (0, tile_size - data.shape[1])],
+                              constant_values=np.nan)
+            yield x, y, np.ascontiguousarray(data)
+
+
+def _render(path, data, cmap, norm):
+    """Write one tile as an RGBA PNG; NaN cells are transparent."""
+    from matplotlib.image import imsave
+
+    def write(f):
+        buffer = io.BytesIO()
+        imsave(buffer, cmap(norm(data), bytes=True), format="png")
+        f.write(buffer.getvalue())
+
+    atomic_write(path, write)
+
+
+@instrumented("export")
+def write_tiles(grid, directory, extent=None, cmap="Blues", vmin=None, vmax=None,
+                tile_size=256, workers=None):
+    """Write ``grid`` as a tile pyramid, rewriting only the tiles that changed.
+
+    Args:
+      grid: 2-D array laid out like ``pcp`` (row 0 at the top); NaN cells
+        are transparent.
+      directory: output directory of ``<z>/<x>/<y>.png`` and ``tiles.json``.
+      extent: ``[x0, x1, y0, y1]`` of the grid, as given to ``plt.imshow``;
+        only recorded in the metadata.
+      cmap: matplotlib colour map name.
+      vmin, vmax: colour range; defaults to the range of ``grid``. Give a
+        fixed range when the surface is updated, or every tile changes colour.
+      tile_size: tile width and height in pixels.
+      workers: number of encoding threads (default: CPU count).
+
+    Returns:
+      ``{"written": n, "unchanged": n, "removed": n}``.
+    """
+    import matplotlib
+    from matplotlib.colors import Normalize
+
+    directory = Path(directory)
+    grid = np.asarray(grid, dtype=np.float32)
+    if vmin is None:
+        vmin = float(np.nanmin(grid))
+    if vmax is None:
+        vmax = float(np.nanmax(grid))
+    colours = matplotlib.colormaps[cmap]
+    norm = Normalize(vmin, vmax)
+    options = f"tiles-v1|{cmap}|{vmin!r}|{vmax!r}|{tile_size}".encode()
+
+    manifest_path = directory / MANIFEST
+    old = {}
+    if manifest_path.exists():
+        old = json.loads(manifest_path.read_text()).get("tiles", {})
+
+    levels = pyramid(grid, tile_size)
+    hashes, stale = {}, []
+    for z, level in enumerate(levels):
+        for x, y, data in _tiles(level, tile_size):
+            name = f"{z}/{x}/{y}"
+            hashes[name] = hashlib.sha256(options + data.tobytes()).hexdigest()[:32]
+            if old.get(name) != hashes[name] or not (directory / f"{name}.png").exists():
+                stale.append((directory / f"{name}.png", data))
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        list(pool.map(lambda item: _render(*item, colours, norm), stale))
+
+    removed = 0
+    for name in set(old) - set(hashes):
+        path = directory / f"{name}.png"
+        if path.exists():
+            path.unlink()
+            removed += 1
+
+    metadata = {
+        "tile_size": tile_size,
+        "levels": [{"z": z, "height": level.shape[0], "width": level.shape[1]}
+                   for z, level in enumerate(levels)],
+        "extent": None if extent is None else [float(v) for v in extent],
+        "cmap": cmap,
+        "vmin": vmin,
+        "vmax": vmax,
+        "tiles": hashes,
+    }
+    atomic_write(manifest_path, lambda f: f.write(json.dumps(metadata, indent=1).encode()))
+    return {"written": len(stale), "unchanged": len(hashes) - len(stale), "removed": removed}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("grid", help="2-D grid saved with np.save")
+    parser.add_argument("directory")
+    parser.add_argument("--extent", type=float, nargs=4, metavar=("X0", "X1", "Y0", "Y1"))
+    parser.add_argument("--cmap", default="Blues")
+    parser.add_argument("--vmin", type=float)
+    parser.add_argument("--vmax", type=float)
+    parser.add_argument("--tile-size", type=int, default=256)
+    parser.add_argument("--workers", type=int)
+    args = parser.parse_args(argv)
+    counts = write_tiles(np.load(args.grid), args.directory, args.extent, args.cmap,
+                         args.vmin, args.vmax, args.tile_size, args.workers)
+    print(", ".join(f"{n} {what}" for what, n in counts.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())